@@ -1,206 +1,40 @@
 import os
 os.environ["KMP_DUPLICATE_LIB_OK"]="TRUE"
+import import_timer
+import_timer.install()
 import cv2
 import json
-import subprocess
+import shutil
+import tempfile
 import numpy as np
-from _collections import deque
-from deep_sort_realtime.deepsort_tracker import DeepSort
-from stqdm import stqdm
 from collections import Counter
 import time
-from ultralytics import YOLO
-from ultralytics.yolo.engine.results import Results
 import json
-from model_utils import get_system_stat
-from streamlit_webrtc import RTCConfiguration, VideoTransformerBase, webrtc_streamer
+from model_utils import SystemStatView
+from processing import image_processing, video_processing, multi_stream_processing
+from batching import get_live_batcher
+from detection_store import DetectionStore
+from trails import TrailStore
+from model_registry import get_model
+from capture import LatestFrameCapture, RTSPSource
+from scheduling import KeyframeScheduler, MotionGate, ResolutionController
+from tiling import TiledPredictor
+from result_cache import result_cache, cache_key, model_id
+from preview import PreviewPublisher
 # from DistanceEstimation import *
-from streamlit_autorefresh import st_autorefresh
 import streamlit as st
-
-# colors for visualization for image visualization
-COLORS = [(56, 56, 255), (151, 157, 255), (31, 112, 255), (29, 178, 255), (49, 210, 207), (10, 249, 72), (23, 204, 146),
-          (134, 219, 61), (52, 147, 26), (187, 212, 0), (168, 153, 44), (255, 194, 0), (147, 69, 52), (255, 115, 100),
-          (236, 24, 0), (255, 56, 132), (133, 0, 82), (255, 56, 203), (200, 149, 255), (199, 55, 255)]
-
+# heavy dependencies (ultralytics, deep_sort_realtime, stqdm, streamlit_webrtc, ...) are imported by the input modes that need them
 
 st.set_page_config(page_title="NightJars YOLOv8 ", layout="wide", page_icon="detective.ico")
 st.sidebar.image("nsidelogo.png")
 st.image("nsidelogoo.png")
 
-def result_to_json(result: Results, tracker=None):
-    """
-    Convert result from ultralytics YOLOv8 prediction to json format
-    Parameters:
-        result: Results from ultralytics YOLOv8 prediction
-        tracker: DeepSort tracker
-    Returns:
-        result_list_json: detection result in json format
-    """
-    len_results = len(result.boxes)
-    result_list_json = [
-        {
-            'class_id': int(result.boxes.cls[idx]),
-            'class': result.names[int(result.boxes.cls[idx])],
-            'confidence': float(result.boxes.conf[idx]),
-            'bbox': {
-                'x_min': int(result.boxes.boxes[idx][0]),
-                'y_min': int(result.boxes.boxes[idx][1]),
-                'x_max': int(result.boxes.boxes[idx][2]),
-                'y_max': int(result.boxes.boxes[idx][3]),
-            },
-        } for idx in range(len_results)
-    ]
-    if result.masks is not None:
-        for idx in range(len_results):
-            result_list_json[idx]['mask'] = cv2.resize(result.masks.data[idx].cpu().numpy(), (result.orig_shape[1], result.orig_shape[0])).tolist()
-            result_list_json[idx]['segments'] = result.masks.segments[idx].tolist()
-    if tracker is not None:
-        bbs = [
-            (
-                [
-                    result_list_json[idx]['bbox']['x_min'],
-                    result_list_json[idx]['bbox']['y_min'],
-                    result_list_json[idx]['bbox']['x_max'] - result_list_json[idx]['bbox']['x_min'],
-                    result_list_json[idx]['bbox']['y_max'] - result_list_json[idx]['bbox']['y_min']
-                ],
-                result_list_json[idx]['confidence'],
-                result_list_json[idx]['class'],
-            ) for idx in range(len_results)
-        ]
-        tracks = tracker.update_tracks(bbs, frame=result.orig_img)
-        for idx in range(len(result_list_json)):
-            track_idx = next((i for i, track in enumerate(tracks) if track.det_conf is not None and np.isclose(track.det_conf, result_list_json[idx]['confidence'])), -1)
-            if track_idx != -1:
-                result_list_json[idx]['object_id'] = int(tracks[track_idx].track_id)
-    return result_list_json
-
-
-def view_result_ultralytics(result: Results, result_list_json, centers=None):
-    """
-    Visualize result from ultralytics YOLOv8 prediction using ultralytics YOLOv8 built-in visualization function
-    Parameters:
-        result: Results from ultralytics YOLOv8 prediction
-        result_list_json: detection result in json format
-        centers: list of deque of center points of bounding boxes
-    Returns:
-        result_image_ultralytics: result image from ultralytics YOLOv8 built-in visualization function
-    """
-    result_image_ultralytics = result.plot()
-    for result_json in result_list_json:
-        class_color = COLORS[result_json['class_id'] % len(COLORS)]
-        if 'object_id' in result_json and centers is not None:
-            centers[result_json['object_id']].append((int((result_json['bbox']['x_min'] + result_json['bbox']['x_max']) / 2), int((result_json['bbox']['y_min'] + result_json['bbox']['y_max']) / 2)))
-            for j in range(1, len(centers[result_json['object_id']])):
-                if centers[result_json['object_id']][j - 1] is None or centers[result_json['object_id']][j] is None:
-                    continue
-                thickness = int(np.sqrt(64 / float(j + 1)) * 2)
-                cv2.line(result_image_ultralytics, centers[result_json['object_id']][j - 1], centers[result_json['object_id']][j], class_color, thickness)
-    return result_image_ultralytics
-
-
-def view_result_default(result: Results, result_list_json, centers=None):
-    """
-    Visualize result from ultralytics YOLOv8 prediction using default visualization function
-    Parameters:
-        result: Results from ultralytics YOLOv8 prediction
-        result_list_json: detection result in json format
-        centers: list of deque of center points of bounding boxes
-    Returns:
-        result_image_default: result image from default visualization function
-    """
-    ALPHA = 0.5
-    image = result.orig_img
-    for result in result_list_json:
-        class_color = COLORS[result['class_id'] % len(COLORS)]
-        if 'mask' in result:
-            image_mask = np.stack([np.array(result['mask']) * class_color[0], np.array(result['mask']) * class_color[1], np.array(result['mask']) * class_color[2]], axis=-1).astype(np.uint8)
-            image = cv2.addWeighted(image, 1, image_mask, ALPHA, 0)
-        text = f"{result['class']} {result['object_id']}: {result['confidence']:.2f}" if 'object_id' in result else f"{result['class']}: {result['confidence']:.2f}"
-        cv2.rectangle(image, (result['bbox']['x_min'], result['bbox']['y_min']), (result['bbox']['x_max'], result['bbox']['y_max']), class_color, 2)
-        (text_width, text_height), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.75, 2)
-        cv2.rectangle(image, (result['bbox']['x_min'], result['bbox']['y_min'] - text_height - baseline), (result['bbox']['x_min'] + text_width, result['bbox']['y_min']), class_color, -1)
-        cv2.putText(image, text, (result['bbox']['x_min'], result['bbox']['y_min'] - baseline), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 255, 255), 2)
-        if 'object_id' in result and centers is not None:
-            centers[result['object_id']].append((int((result['bbox']['x_min'] + result['bbox']['x_max']) / 2), int((result['bbox']['y_min'] + result['bbox']['y_max']) / 2)))
-            for j in range(1, len(centers[result['object_id']])):
-                if centers[result['object_id']][j - 1] is None or centers[result['object_id']][j] is None:
-                    continue
-                thickness = int(np.sqrt(64 / float(j + 1)) * 2)
-                cv2.line(image, centers[result['object_id']][j - 1], centers[result['object_id']][j], class_color, thickness)
-    return image
-
-
-def image_processing(frame, model, image_viewer=view_result_default, tracker=None, centers=None):
-    """
-    Process image frame using ultralytics YOLOv8 model and possibly DeepSort tracker if it is provided
-    Parameters:
-        frame: image frame
-        model: ultralytics YOLOv8 model
-        image_viewer: function to visualize result, default is view_result_default, can be view_result_ultralytics
-        tracker: DeepSort tracker
-        centers: list of deque of center points of bounding boxes
-    Returns:
-        result_image: result image with bounding boxes, class names, confidence scores, object masks, and possibly object IDs
-        result_list_json: detection result in json format
-    """
-    results = model.predict(frame)
-    result_list_json = result_to_json(results[0], tracker=tracker)
-    result_image = image_viewer(results[0], result_list_json, centers=centers)
-    return result_image, result_list_json
-
-
-def video_processing(video_file, model, image_viewer=view_result_default, tracker=None, centers=None):
-    """
-    Process video file using ultralytics YOLOv8 model and possibly DeepSort tracker if it is provided
-    Parameters:
-        video_file: video file
-        model: ultralytics YOLOv8 model
-        image_viewer: function to visualize result, default is view_result_default, can be view_result_ultralytics
-        tracker: DeepSort tracker
-        centers: list of deque of center points of bounding boxes
-    Returns:
-        video_file_name_out: name of output video file
-        result_video_json_file: file containing detection result in json format
-    """
-    results = model.predict(video_file)
-    model_name = model.ckpt_path.split('/')[-1].split('.')[0]
-    output_folder = os.path.join('output_videos', video_file.split('.')[0])
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
-    video_file_name_out = os.path.join(output_folder, f"{video_file.split('.')[0]}_{model_name}_output.mp4")
-    if os.path.exists(video_file_name_out):
-        os.remove(video_file_name_out)
-    result_video_json_file = os.path.join(output_folder, f"{video_file.split('.')[0]}_{model_name}_output.json")
-    if os.path.exists(result_video_json_file):
-        os.remove(result_video_json_file)
-    json_file = open(result_video_json_file, 'a')
-    temp_file = 'temp.mp4'
-    video_writer = cv2.VideoWriter(temp_file, cv2.VideoWriter_fourcc(*'mp4v'), 30, (results[0].orig_img.shape[1], results[0].orig_img.shape[0]))
-    json_file.write('[\n')
-    for result in stqdm(results, desc=f"Processing video"):
-        result_list_json = result_to_json(result, tracker=tracker)
-        result_image = image_viewer(result, result_list_json, centers=centers)
-        video_writer.write(result_image)
-        json.dump(result_list_json, json_file, indent=2)
-        json_file.write(',\n')
-    json_file.write(']')
-    video_writer.release()
-    subprocess.call(args=f"ffmpeg -i {os.path.join('.', temp_file)} -c:v libx264 {os.path.join('.', video_file_name_out)}".split(" "))
-    os.remove(temp_file)
-    return video_file_name_out, result_video_json_file
-
-
-
 model_select = "yolov8xcdark.pt"
-
-model = YOLO(model_select,'conf=0.45')  # Model initialization
 model_seg = "yolov8xcdark-seg.pt"
-
-model1 = YOLO(model_seg)  # Model initialization
+# models are loaded once per process on first use and shared across sessions and reruns
 
 modelv = "yolov8m.pt"
-source = ("Image Detection📸", "Video Detections📽️", "Live Camera Detection🤳🏻","RTSP","MOBILE CAM")
+source = ("Image Detection📸", "Video Detections📽️", "Live Camera Detection🤳🏻","RTSP","MOBILE CAM","MULTI CAM")
 source_index = st.sidebar.selectbox("Select Input type", range(
         len(source)), format_func=lambda x: source[x])
 
@@ -211,6 +45,11 @@ if source_index == 0:
     image_file = st.file_uploader("Upload an image 🔽", type=["jpg", "jpeg", "png"])
     process_image_button = st.button("Detect")
     process_seg_button = st.button("Click here for Segmentation result")
+    tiled = st.sidebar.checkbox("Tiled high-resolution detection (small distant objects)")
+    if tiled:
+        tile_size = st.sidebar.slider("Tile size", 320, 1280, 640, step=32)
+        tile_overlap = st.sidebar.slider("Tile overlap", 0.0, 0.5, 0.2)
+        max_tiles = st.sidebar.slider("Maximum tiles per frame", 2, 32, 16)
 
     with st.spinner("Detecting with 💕"):
         if image_file is None and process_image_button:
@@ -219,11 +58,19 @@ if source_index == 0:
             st.write(" ")
             st.sidebar.success("Successfully uploaded")
             st.sidebar.image(image_file,caption="Uploaded image")
-            img = cv2.imdecode(np.frombuffer(image_file.read(), np.uint8), 1)
-            
+            image_bytes = image_file.getvalue()
+
+            def detect():
+                print(f"Used Custom reframed YOLOv8 model: {model_select}")
+                model = get_model(model_select)
+                if tiled:
+                    model = TiledPredictor(model, tile_size=tile_size, overlap=tile_overlap, max_tiles=max_tiles)
+                return image_processing(cv2.imdecode(np.frombuffer(image_bytes, np.uint8), 1), model)
+
         #     ## for detection with bb
-            print(f"Used Custom reframed YOLOv8 model: {model_select}")
-            img, result_list_json = image_processing(img, model)
+            # same image, model and parameters return the cached result, across reruns and sessions
+            params = {'tile_size': tile_size, 'overlap': tile_overlap, 'max_tiles': max_tiles} if tiled else {}
+            img, result_list_json = result_cache.get_or_compute(cache_key(image_bytes, model_id(model_select), params), detect)
             # print(json.dumps(result_list_json, indent=2))
             st.success("✅ Task Detect : Detection using custom-trained v8 model")
             st.image(img, caption="Detected image", channels="BGR")
@@ -232,11 +79,15 @@ if source_index == 0:
             st.write(" ")
             st.sidebar.success("Successfully uploaded")
             st.sidebar.image(image_file,caption="Uploaded image")
-            img = cv2.imdecode(np.frombuffer(image_file.read(), np.uint8), 1) 
-           
+            image_bytes = image_file.getvalue()
+
+            def segment():
+                print(f"Segmentation YOLOv8 model: {model_seg}")
+                # run-length masks, full-frame mask lists would dominate the cached entry
+                return image_processing(cv2.imdecode(np.frombuffer(image_bytes, np.uint8), 1), get_model(model_seg), mask_format='rle')
+
             ## for detection with bb & segmentation masks
-            print(f"Segmentation YOLOv8 model: {model1}")
-            img, result_list_json = image_processing(img, model1)
+            img, result_list_json = result_cache.get_or_compute(cache_key(image_bytes, model_id(model_seg), {'mask_format': 'rle'}), segment)
             st.success("✅ Task Segment: Segmentation using v8 model")
             st.image(img, caption="Segmented image", channels="BGR")
 
@@ -250,16 +101,43 @@ if source_index == 1:
     st.header("Video Processing using YOLOv8")
     video_file = st.file_uploader("Upload a video 🔽", type=["mp4"])
     process_video_button = st.button("Process Video")
+    keyframe_interval = st.sidebar.slider("Detect every N frames (tracker predicts in between)", 1, 5, 1)
+    tiled = st.sidebar.checkbox("Tiled high-resolution detection (small distant objects)")
+    if tiled:
+        tile_size = st.sidebar.slider("Tile size", 320, 1280, 640, step=32)
+        tile_overlap = st.sidebar.slider("Tile overlap", 0.0, 0.5, 0.2)
+        max_tiles = st.sidebar.slider("Maximum tiles per frame", 2, 32, 16)
+    log_compression = st.sidebar.selectbox("Detection log compression", ("none", "gzip", "zstd"))
     if video_file is None and process_video_button:
         st.warning("Please upload a video file to be processed!")
     if video_file is not None and process_video_button:
         with st.spinner(text='Detecting with 💕...'):
+            from deep_sort_realtime.deepsort_tracker import DeepSort
             tracker = DeepSort(max_age=5)
-            centers = [deque(maxlen=30) for _ in range(10000)]
-            open(video_file.name, "wb").write(video_file.read())
-            video_file_out, result_video_json_file = video_processing(video_file.name, model, tracker=tracker, centers=centers)
-            os.remove(video_file.name)
+            centers = TrailStore(maxlen=30)
+            scheduler = KeyframeScheduler(interval=keyframe_interval) if keyframe_interval > 1 else None
+            stage_report = []
+            # each job gets its own copy of the upload, outputs are still named after the video
+            upload_dir = tempfile.mkdtemp(prefix='nightjars_upload_')
+            upload_path = os.path.join(upload_dir, os.path.basename(video_file.name))
+            open(upload_path, "wb").write(video_file.read())
+            model = get_model(model_select)
+            if tiled:
+                # tiles of all frames in a batch share one forward pass, keep batches small
+                model = TiledPredictor(model, tile_size=tile_size, overlap=tile_overlap, max_tiles=max_tiles)
+            from stqdm import stqdm
+            try:
+                video_file_out, result_video_json_file, store_dir = video_processing(upload_path, model, tracker=tracker, centers=centers, stage_report=stage_report, scheduler=scheduler,
+                                                                          batch_size=2 if tiled else 8, log_compression=None if log_compression == "none" else log_compression, progress=stqdm)
+            finally:
+                shutil.rmtree(upload_dir, ignore_errors=True)
             st.video(video_file_out)
+            with st.expander("Pipeline stage throughput"):
+                st.table(stage_report)
+            with st.expander("Detections by class"):
+                store = DetectionStore(store_dir)
+                st.table([{'class': name, 'detections': store.count(class_id=class_id), 'objects': store.count(unique_tracks=True, class_id=class_id)}
+                          for class_id, name in store.class_names.items()])
             # print(json.dumps(result_video_json_file, indent=2))
             # video_bytes = open(video_file_out, 'rb').read()
             # st.video(video_bytes)
@@ -268,7 +146,6 @@ if source_index == 1:
 
 if source_index == 2:
     st.caption("## Live Stream Processing using YOLOv8")
-    p_time = 0
 
     model_type = "YOLOv8"
     sample_img = cv2.imread('detective.png')
@@ -290,31 +167,55 @@ if source_index == 2:
             cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
             if stop:
                 run = False
+            keyframe_interval = st.sidebar.slider("Detect every N frames (tracker predicts in between)", 1, 5, 1)
+            motion_gating = st.sidebar.selectbox("Motion gating", ("Off", "Skip static frames", "Detect on moving region only"))
+            motion_sensitivity = st.sidebar.slider("Motion sensitivity", 1, 10, 5)
+            target_fps = st.sidebar.slider("Target fps (lower resolution and skip frames to keep up, 0 = off)", 0, 30, 0)
+            preview_fps = st.sidebar.slider("Preview refresh rate (fps)", 1, 30, 10)
+            preview_width = st.sidebar.slider("Preview width", 320, 1280, 720, step=40)
+            preview_quality = st.sidebar.slider("Preview JPEG quality", 30, 95, 70)
             FRAME_WINDOW = st.image([], width=720)
             if run:
                 stframe1 = st.empty()
                 stframe2 = st.empty()
+                stframe3 = st.empty()
+                stat_view = SystemStatView(stframe1, stframe2)
+                # the display gets downscaled JPEGs at its own rate, processing keeps the full resolution frames
+                preview = PreviewPublisher(FRAME_WINDOW, max_fps=preview_fps, max_width=preview_width, quality=preview_quality)
+                from deep_sort_realtime.deepsort_tracker import DeepSort
                 tracker = DeepSort(max_age=5)
-                centers = [deque(maxlen=30) for _ in range(10000)]
-                while True:
-                    success, image = cap.read()
-                    if not success:
-                        st.info(
-                            f" NOT working\nCheck {cam_options} properly ⛔!!",
-                            icon="🎦"
-                        )
-                        break
-                    image, result_list_json = image_processing(image, model, tracker=tracker, centers=centers)
-                    FRAME_WINDOW.image(image, channels='BGR', width=1000)
-
-                    # FPS
-                    c_time = time.time()
-                    fps = 1 / (c_time - p_time)
-                    p_time = c_time
-                
-                   
-                        # Updating Inference results
-                    get_system_stat(stframe1, stframe2, fps)
+                centers = TrailStore(maxlen=30)
+                scheduler = KeyframeScheduler(interval=keyframe_interval) if keyframe_interval > 1 else None
+                gate = None
+                if motion_gating != "Off":
+                    gate = MotionGate(mode='skip' if motion_gating == "Skip static frames" else 'roi', min_changed=0.01 / motion_sensitivity)
+                controller = ResolutionController(target_fps=target_fps) if target_fps else None
+                # shared by every live session, frames of concurrent streams are batched together
+                batcher = get_live_batcher(get_model(model_select))
+                capture = LatestFrameCapture(cap).start()
+                frame_index = 0
+                try:
+                    while True:
+                        captured = capture.read(timeout=5)
+                        if captured is None:
+                            st.info(
+                                f" NOT working\nCheck {cam_options} properly ⛔!!",
+                                icon="🎦"
+                            )
+                            break
+                        image, result_list_json = image_processing(captured.frame, batcher.for_stream(cam_options), tracker=tracker, centers=centers, scheduler=scheduler, gate=gate,
+                                                                    controller=controller)
+                        preview.publish(image)
+                        latency_ms = round((time.time() - captured.timestamp) * 1000, 1)
+                        frame_index += 1
+                        if frame_index % 30 == 0:
+                            stframe3.json({'latency_ms': latency_ms, **capture.stats(), **batcher.report(), **(scheduler.stats() if scheduler else {}), **(gate.stats() if gate else {}),
+                                          **(controller.stats() if controller else {}), **preview.stats()})
+
+                        # FPS and system stats, refreshed from the background sampler about once a second
+                        stat_view.update()
+                finally:
+                    capture.stop()
                 tracker.delete_all_tracks()
                 centers.clear()
 
@@ -323,7 +224,6 @@ if source_index == 2:
 
 if source_index == 3:
     st.caption("## Real Time Streaming Protocol (RTSP) Processing using YOLOv8")
-    p_time = 0
     model_type = "YOLOv8"
     cap = None
 
@@ -338,36 +238,61 @@ if source_index == 3:
             col_run, col_stop = st.columns(2)
             run = col_run.button("Start Live Stream Processing")
             stop = col_stop.button("Stop Live Stream Processing")
-            cap = cv2.VideoCapture(rtsp_url)
-            cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1100)
-            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
             if stop:
                 run = False
+            keyframe_interval = st.sidebar.slider("Detect every N frames (tracker predicts in between)", 1, 5, 1)
+            motion_gating = st.sidebar.selectbox("Motion gating", ("Off", "Skip static frames", "Detect on moving region only"))
+            motion_sensitivity = st.sidebar.slider("Motion sensitivity", 1, 10, 5)
+            target_fps = st.sidebar.slider("Target fps (lower resolution and skip frames to keep up, 0 = off)", 0, 30, 0)
+            preview_fps = st.sidebar.slider("Preview refresh rate (fps)", 1, 30, 10)
+            preview_width = st.sidebar.slider("Preview width", 320, 1280, 720, step=40)
+            preview_quality = st.sidebar.slider("Preview JPEG quality", 30, 95, 70)
             FRAME_WINDOW = st.image([], width=720)
             if run:
                 stframe1 = st.empty()
                 stframe2 = st.empty()
+                stframe3 = st.empty()
+                stat_view = SystemStatView(stframe1, stframe2)
+                # the display gets downscaled JPEGs at its own rate, processing keeps the full resolution frames
+                preview = PreviewPublisher(FRAME_WINDOW, max_fps=preview_fps, max_width=preview_width, quality=preview_quality)
+                from deep_sort_realtime.deepsort_tracker import DeepSort
                 tracker = DeepSort(max_age=5)
-                centers = [deque(maxlen=30) for _ in range(10000)]
-                while True:
-                    success, image = cap.read()
-                    if not success:
-                        st.info(
-                            f" NOT working\nCheck {rtsp_url} properly ⛔!!",
-                            icon="🎦"
-                        )
-                        break
-                    image, result_list_json = image_processing(image, model, tracker=tracker, centers=centers)
-                    FRAME_WINDOW.image(image, channels='BGR', width=720)
-
-                    # FPS
-                    c_time = time.time()
-                    fps = 1 / (c_time - p_time)
-                    p_time = c_time
-                
-                   
-                        # Updating Inference results
-                    get_system_stat(stframe1, stframe2, fps)
+                centers = TrailStore(maxlen=30)
+                scheduler = KeyframeScheduler(interval=keyframe_interval) if keyframe_interval > 1 else None
+                gate = None
+                if motion_gating != "Off":
+                    gate = MotionGate(mode='skip' if motion_gating == "Skip static frames" else 'roi', min_changed=0.01 / motion_sensitivity)
+                controller = ResolutionController(target_fps=target_fps) if target_fps else None
+                # shared by every live session, frames of concurrent streams are batched together
+                batcher = get_live_batcher(get_model(model_select))
+                # reconnects with exponential backoff, gives up after max_reconnects failed attempts in a row
+                capture = RTSPSource(rtsp_url, max_reconnects=8).start()
+                frame_index = 0
+                try:
+                    while True:
+                        captured = capture.read(timeout=1)
+                        if captured is None:
+                            if not capture.ended:
+                                stframe3.json({**capture.stats(), **batcher.report()})
+                                continue
+                            st.info(
+                                f" NOT working\nCheck {rtsp_url} properly ⛔!!",
+                                icon="🎦"
+                            )
+                            break
+                        image, result_list_json = image_processing(captured.frame, batcher.for_stream(rtsp_url), tracker=tracker, centers=centers, scheduler=scheduler, gate=gate,
+                                                                    controller=controller)
+                        preview.publish(image)
+                        latency_ms = round((time.time() - captured.timestamp) * 1000, 1)
+                        frame_index += 1
+                        if frame_index % 30 == 0:
+                            stframe3.json({'latency_ms': latency_ms, **capture.stats(), **batcher.report(), **(scheduler.stats() if scheduler else {}), **(gate.stats() if gate else {}),
+                                          **(controller.stats() if controller else {}), **preview.stats()})
+
+                        # FPS and system stats, refreshed from the background sampler about once a second
+                        stat_view.update()
+                finally:
+                    capture.stop()
 
                 tracker.delete_all_tracks()
                 centers.clear()
@@ -380,6 +305,8 @@ if source_index == 4:
     p_time = 0
 
     
+    from streamlit_webrtc import RTCConfiguration, VideoTransformerBase, webrtc_streamer
+    from streamlit_autorefresh import st_autorefresh
     RTC_CONFIGURATION = RTCConfiguration({"iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]})
 
     count = st_autorefresh(interval=4500, limit=1000000, key="fizzbuzzcounter")
@@ -408,3 +335,60 @@ if source_index == 4:
         
 #     webrtc_streamer(key="WYH", media_stream_constraints={"video": True, "audio": False}, 
 #                     video_processor_factory=VideoTransformer,)
+
+
+
+if source_index == 5:
+    st.caption("## Multi-Camera Processing using YOLOv8")
+    stream_sources = st.text_area('Camera channels or RTSP URLs, one per line 🔽:', '0')
+    sources = [x.strip() for x in stream_sources.splitlines() if x.strip()]
+    col_run, col_stop = st.columns(2)
+    run = col_run.button("Start Multi-Camera Processing")
+    stop = col_stop.button("Stop Multi-Camera Processing")
+    if stop:
+        run = False
+    grid_columns = st.sidebar.slider("Grid columns", 1, 6, min(len(sources), 4) or 1)
+    preview_fps = st.sidebar.slider("Preview refresh rate (fps)", 1, 30, 5)
+    preview_quality = st.sidebar.slider("Preview JPEG quality", 30, 95, 70)
+    if run and sources:
+        from deep_sort_realtime.deepsort_tracker import DeepSort
+        stframe1 = st.empty()
+        stframe2 = st.empty()
+        stat_view = SystemStatView(stframe1, stframe2)
+        cells = []
+        for row_start in range(0, len(sources), grid_columns):
+            for col in st.columns(grid_columns)[:len(sources) - row_start]:
+                cells.append(col.empty())
+        # each cell is only a fraction of the page wide, previews are downscaled to match
+        previews = [PreviewPublisher(cell, max_fps=preview_fps, max_width=max(1280 // grid_columns, 320), quality=preview_quality) for cell in cells]
+        # every stream is read on its own latest-frame capture, camera channels directly and URLs with reconnects
+        captures = [LatestFrameCapture(cv2.VideoCapture(int(x))).start() if x.isnumeric() else RTSPSource(x, max_reconnects=8).start()
+                    for x in sources]
+        # one shared model runs a single batched prediction over the new frames of all streams
+        multi_model = get_model(model_select)
+        trackers = [DeepSort(max_age=5) for _ in sources]
+        centers = [TrailStore(maxlen=30) for _ in sources]
+        try:
+            while True:
+                captured = [capture.read(timeout=0) for capture in captures]
+                # streams without a new frame since the last batch are left out, their tracker is not fed the same frame twice
+                fresh = [idx for idx, frame in enumerate(captured) if frame is not None]
+                if not fresh:
+                    if all(capture.ended for capture in captures):
+                        st.info(" NOT working\nCheck the camera channels and URLs properly ⛔!!", icon="🎦")
+                        break
+                    time.sleep(0.005)
+                    continue
+                outputs = multi_stream_processing([captured[idx].frame for idx in fresh], multi_model,
+                                                  trackers=[trackers[idx] for idx in fresh], centers=[centers[idx] for idx in fresh])
+                for idx, (image, result_list_json) in zip(fresh, outputs):
+                    previews[idx].publish(image, caption=f"{sources[idx]}: {len(result_list_json)} objects")
+
+                # FPS over all streams, only new frames are counted
+                stat_view.update(len(fresh))
+        finally:
+            for capture in captures:
+                capture.stop()
+
+with st.sidebar.expander("Startup time by module"):
+    st.table(import_timer.import_report())
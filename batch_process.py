@@ -0,0 +1,216 @@
+import os
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def list_jobs(source):
+    """
+    Media files to process
+    Parameters:
+        source: directory, searched recursively, or manifest file with one media path per line
+    Returns:
+        list of video and image paths, sorted
+    """
+    if os.path.isdir(source):
+        paths = [os.path.join(root, name) for root, _, names in os.walk(source) for name in names]
+    else:
+        with open(source) as manifest:
+            paths = [line.strip() for line in manifest if line.strip() and not line.startswith('#')]
+    return sorted({path for path in paths if path.lower().endswith(VIDEO_EXTENSIONS + IMAGE_EXTENSIONS)})
+
+
+def source_root(source, paths):
+    """
+    Folder the output tree mirrors, the source directory, or the deepest folder holding every file of a manifest
+    """
+    if os.path.isdir(source):
+        return source
+    return os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths]) if paths else '.'
+
+
+def job_output_root(path, root, output_root):
+    """
+    Output root of one job, mirroring the folder of the file relative to `root`, so files with the same name in
+    different folders (a/cam1.mp4, b/cam1.mp4) do not share outputs
+    Parameters:
+        path: video or image file
+        root: folder the output tree mirrors, see source_root
+        output_root: output root folder of the run
+    Returns:
+        folder under which the job's output folder is created
+    """
+    relative = os.path.relpath(os.path.dirname(os.path.abspath(path)), os.path.abspath(root))
+    return os.path.normpath(os.path.join(output_root, relative))
+
+
+def image_output_paths(image_file, checkpoint, output_root='output_videos'):
+    """
+    Output files of an image job, annotated image and detection result in json format
+    """
+    model_name = checkpoint.split('/')[-1].split('.')[0]
+    image_name = os.path.splitext(os.path.basename(image_file))[0]
+    output_folder = os.path.join(output_root, image_name)
+    return (os.path.join(output_folder, f"{image_name}_{model_name}_output.jpg"),
+            os.path.join(output_folder, f"{image_name}_{model_name}_output.json"))
+
+
+def is_completed(path, opt, output_root):
+    # outputs are moved into place only once a job succeeded, so their presence marks completed jobs
+    if path.lower().endswith(VIDEO_EXTENSIONS):
+        from processing import video_output_paths
+        video_out, log_out, store_dir = video_output_paths(path, opt['model'], output_root, opt['log_compression'])
+        return os.path.exists(video_out) and os.path.exists(log_out) and os.path.exists(os.path.join(store_dir, 'meta.json'))
+    return all(os.path.exists(output) for output in image_output_paths(path, opt['model'], output_root))
+
+
+def init_worker(threads):
+    """
+    Limit the intra-op threads of a worker process, so workers do not oversubscribe the CPU cores
+    """
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    import cv2
+    import torch
+    torch.set_num_threads(threads)
+    cv2.setNumThreads(threads)
+
+
+def process_job(path, opt, output_root):
+    """
+    Process one video or image in a worker process, the model is loaded once per worker
+    Parameters:
+        path: video or image file
+        opt: dict of command line options
+        output_root: folder under which the job's output folder is created, see job_output_root
+    Returns:
+        dict with path, worker pid, status, number of frames and processing time
+    """
+    import cv2
+    from model_registry import get_model
+    from processing import image_processing, video_processing
+    t = time.time()
+    report = {'path': path, 'worker': os.getpid(), 'status': 'done', 'frames': 0}
+    try:
+        model = get_model(opt['model'])
+        if path.lower().endswith(VIDEO_EXTENSIONS):
+            tracker = None
+            if opt['track']:
+                from deep_sort_realtime.deepsort_tracker import DeepSort
+                tracker = DeepSort(max_age=5)
+            stage_report = []
+            video_processing(path, model, tracker=tracker, stage_report=stage_report, batch_size=opt['batch_size'],
+                             encoder=opt['encoder'], preset=opt['preset'], encoder_threads=opt['threads'],
+                             log_compression=opt['log_compression'], output_root=output_root)
+            report['frames'] = stage_report[-1]['items'] if stage_report else 0
+        else:
+            image_out, json_out = image_output_paths(path, opt['model'], output_root)
+            os.makedirs(os.path.dirname(image_out), exist_ok=True)
+            image, result_list_json = image_processing(cv2.imread(path), model)
+            # write under a temporary name and move into place, so an interrupted job is not taken as completed
+            cv2.imwrite(image_out + '.partial.jpg', image)
+            with open(json_out + '.partial', 'w') as json_file:
+                json.dump(result_list_json, json_file)
+            os.replace(image_out + '.partial.jpg', image_out)
+            os.replace(json_out + '.partial', json_out)
+            report['frames'] = 1
+    except Exception as e:
+        report['status'] = 'failed'
+        report['error'] = repr(e)
+    report['seconds'] = round(time.time() - t, 2)
+    return report
+
+
+def throughput_summary(reports, wall_s, workers):
+    """
+    Throughput of a batch run, overall and per worker process
+    Parameters:
+        reports: list of job reports returned by process_job
+        wall_s: wall clock duration of the run in seconds
+        workers: number of worker processes
+    Returns:
+        dict with job counts, videos per hour, frames per second, and per worker frames per second
+    """
+    done = [report for report in reports if report['status'] == 'done']
+    videos = [report for report in done if report['path'].lower().endswith(VIDEO_EXTENSIONS)]
+    per_worker = {}
+    for report in done:
+        stats = per_worker.setdefault(report['worker'], {'jobs': 0, 'frames': 0, 'busy_s': 0.0})
+        stats['jobs'] += 1
+        stats['frames'] += report['frames']
+        stats['busy_s'] += report['seconds']
+    for stats in per_worker.values():
+        stats['frames_per_s'] = round(stats['frames'] / stats['busy_s'], 2) if stats['busy_s'] else 0.0
+        stats['busy_s'] = round(stats['busy_s'], 2)
+    frames = sum(report['frames'] for report in done)
+    return {
+        'jobs': len(reports),
+        'done': len(done),
+        'failed': len(reports) - len(done),
+        'workers': workers,
+        'wall_s': round(wall_s, 2),
+        'videos_per_hour': round(len(videos) * 3600 / wall_s, 2) if wall_s else 0.0,
+        'frames_per_s': round(frames / wall_s, 2) if wall_s else 0.0,
+        'per_worker': {str(pid): stats for pid, stats in per_worker.items()},
+    }
+
+
+def run(opt):
+    paths = list_jobs(opt['source'])
+    root = source_root(opt['source'], paths)
+    output_roots = {path: job_output_root(path, root, opt['output']) for path in paths}
+    skipped = {path for path in paths if not opt['force'] and is_completed(path, opt, output_roots[path])}
+    pending = [path for path in paths if path not in skipped]
+    print(f"{len(paths)} files, {len(skipped)} already completed, {len(pending)} to process "
+          f"with {opt['workers']} workers x {opt['threads']} threads")
+    reports = []
+    t = time.time()
+    try:
+        # spawn instead of fork, torch and the capture threads are not fork safe
+        with ProcessPoolExecutor(max_workers=opt['workers'], mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=init_worker, initargs=(opt['threads'],)) as executor:
+            futures = {executor.submit(process_job, path, opt, output_roots[path]): path for path in pending}
+            for future in as_completed(futures):
+                try:
+                    report = future.result()
+                except Exception as e:
+                    # the worker process died (e.g. killed when out of memory), the pool fails its remaining jobs too
+                    report = {'path': futures[future], 'worker': None, 'status': 'failed', 'frames': 0, 'seconds': 0.0, 'error': repr(e)}
+                reports.append(report)
+                print(f"[{len(reports)}/{len(pending)}] {report['status']} {report['path']} "
+                      f"({report['frames']} frames in {report['seconds']}s){' ' + report['error'] if 'error' in report else ''}")
+    finally:
+        # written even when the run is interrupted, with the jobs finished so far
+        summary = throughput_summary(reports, time.time() - t, opt['workers'])
+        summary['skipped'] = len(skipped)
+        summary['reports'] = sorted(reports, key=lambda report: report['path'])
+        os.makedirs(opt['output'], exist_ok=True)
+        with open(opt['summary'] or os.path.join(opt['output'], 'batch_summary.json'), 'w') as summary_file:
+            json.dump(summary, summary_file, indent=2)
+    print(f"{summary['done']} done, {summary['failed']} failed, {summary['skipped']} skipped in {summary['wall_s']}s: "
+          f"{summary['videos_per_hour']} videos/hour, {summary['frames_per_s']} frames/s")
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Process a directory or manifest of videos and images without the Streamlit UI')
+    parser.add_argument('source', type=str, help='directory of media files, or manifest file with one path per line')
+    parser.add_argument('--output', type=str, default='output_videos', help='output root folder')
+    parser.add_argument('--model', type=str, default='yolov8xcdark.pt', help='model checkpoint')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes, default cpu count / threads')
+    parser.add_argument('--threads', type=int, default=1, help='torch intra-op threads per worker')
+    parser.add_argument('--batch-size', type=int, default=8, help='frames per forward pass')
+    parser.add_argument('--encoder', type=str, default='ffmpeg', choices=['ffmpeg', 'pyav'], help='H.264 encoder backend')
+    parser.add_argument('--preset', type=str, default='medium', help='x264 encoder preset')
+    parser.add_argument('--log-compression', type=str, default=None, choices=['gzip', 'zstd'], help='detection log compression')
+    parser.add_argument('--no-track', dest='track', action='store_false', help='do not track objects in videos')
+    parser.add_argument('--force', action='store_true', help='reprocess files whose outputs already exist')
+    parser.add_argument('--summary', type=str, default=None, help='throughput summary file, default <output>/batch_summary.json')
+    opt = vars(parser.parse_args())
+    if opt['workers'] is None:
+        opt['workers'] = max((os.cpu_count() or 1) // opt['threads'], 1)
+    run(opt)
@@ -0,0 +1,273 @@
+import os
+import time
+import queue
+import threading
+import weakref
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class _Request:
+    def __init__(self, frame, stream, predict_kwargs):
+        self.frame = frame
+        self.stream = stream
+        self.predict_kwargs = predict_kwargs
+        self.key = tuple(sorted(predict_kwargs.items()))
+        self.future = Future()
+        self.submit_time = time.time()
+
+
+class BatchPredictor:
+    """
+    Collect single frames from any number of callers or sources and run them through the model in batches
+    A batch is sent to the model when `batch_size` frames are waiting or `max_wait_ms` has passed since the
+    first frame of the batch arrived, whichever comes first. Results are split back per frame and returned
+    through futures, so each caller only sees the result of its own frame.
+    With `min_streams` above 1, batches only wait to fill up while that many streams submitted frames in the last
+    second: a single stream waiting on each result can never fill a batch, its frames are sent right away.
+    It can be used in place of the model in image_processing, other attributes are taken from the model.
+    Parameters:
+        model: ultralytics YOLOv8 model
+        batch_size: maximum number of frames in one forward pass
+        max_wait_ms: maximum time to wait for a batch to fill up
+        history: number of recent batches and frames kept for the report
+        min_streams: number of active streams below which batches do not wait to fill up
+    """
+    def __init__(self, model, batch_size=8, max_wait_ms=20, history=1000, min_streams=1):
+        self.model = model
+        self.batch_size = batch_size
+        self.max_wait_ms = max_wait_ms
+        self.min_streams = min_streams
+        self._stream_seen = {}
+        self._queue = queue.Queue()
+        self._deferred = deque()
+        self._lock = threading.Lock()
+        self._batch_sizes = deque(maxlen=history)
+        self._queue_depths = deque(maxlen=history)
+        self._latencies = deque(maxlen=history)
+        self._streams = Counter()
+        self._frames = 0
+        self._busy_time = 0.0
+        self._start_time = time.time()
+        self._closed = False
+        # the worker only holds a weak reference, an unused predictor is freed with its model and its worker exits
+        self._thread = threading.Thread(target=BatchPredictor._run, args=(weakref.ref(self), self._queue), daemon=True)
+        self._thread.start()
+        weakref.finalize(self, self._queue.put, None)
+
+    def __getattr__(self, name):
+        # ckpt_path, names, ... are taken from the wrapped model
+        return getattr(self.__dict__['model'], name)
+
+    def submit(self, frame, stream=None, **predict_kwargs):
+        """
+        Queue one frame for batched prediction
+        Parameters:
+            frame: image frame
+            stream: name of the stream the frame comes from, used for the per-source report
+            predict_kwargs: keyword arguments of model.predict, only frames with equal arguments share a batch
+        Returns:
+            future resolving to Results from ultralytics YOLOv8 prediction of this frame
+        """
+        if self._closed:
+            raise RuntimeError('BatchPredictor is closed')
+        request = _Request(frame, stream, predict_kwargs)
+        with self._lock:
+            self._stream_seen[stream] = request.submit_time
+        self._queue.put(request)
+        return request.future
+
+    def predict(self, source, stream=None, **predict_kwargs):
+        """
+        Drop-in replacement of model.predict for a single frame or a list of frames
+        Parameters:
+            source: image frame or list of image frames
+            stream: name of the stream the frames come from
+        Returns:
+            list of Results from ultralytics YOLOv8 prediction, one per frame
+        """
+        frames = source if isinstance(source, (list, tuple)) else [source]
+        futures = [self.submit(frame, stream=stream, **predict_kwargs) for frame in frames]
+        return [future.result() for future in futures]
+
+    def for_stream(self, stream):
+        """
+        View of this predictor that tags every frame with the given stream name
+        Parameters:
+            stream: name of the stream
+        Returns:
+            object usable in place of the model in image_processing
+        """
+        return _StreamPredictor(self, stream)
+
+    def close(self):
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _next_request(self, timeout):
+        if self._deferred:
+            return self._deferred.popleft()
+        return self._queue.get(timeout=timeout) if timeout is None or timeout > 0 else self._queue.get_nowait()
+
+    def _collect(self, first):
+        batch = [first]
+        deferred = []
+        deadline = first.submit_time + self.max_wait_ms / 1000
+        if self.min_streams > 1 and self.active_streams() < self.min_streams:
+            # only frames already waiting join the batch
+            deadline = 0
+        while len(batch) < self.batch_size:
+            try:
+                request = self._next_request(deadline - time.time())
+            except queue.Empty:
+                break
+            if request is None:
+                self._queue.put(None)
+                break
+            if request.key == first.key:
+                batch.append(request)
+            else:
+                deferred.append(request)
+        self._deferred.extend(deferred)
+        # frames still waiting once the batch is formed
+        with self._lock:
+            self._queue_depths.append(self.queue_depth())
+        return batch
+
+    def active_streams(self, window_s=1.0):
+        """
+        Number of streams that submitted a frame in the last `window_s` seconds
+        """
+        since = time.time() - window_s
+        with self._lock:
+            return sum(seen >= since for seen in self._stream_seen.values())
+
+    def queue_depth(self):
+        """
+        Number of frames waiting for a batch
+        """
+        return self._queue.qsize() + len(self._deferred)
+
+    @staticmethod
+    def _run(ref, requests):
+        while True:
+            predictor = ref()
+            if predictor is None:
+                return
+            if predictor._deferred:
+                first = predictor._deferred.popleft()
+            else:
+                # wait for the next frame without keeping the predictor alive
+                del predictor
+                first = requests.get()
+                predictor = ref()
+                if first is None or predictor is None:
+                    return
+            predictor._predict_batch(predictor._collect(first))
+            del predictor
+
+    def _predict_batch(self, batch):
+        t = time.time()
+        try:
+            results = self.model.predict([request.frame for request in batch], **batch[0].predict_kwargs)
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+            return
+        done = time.time()
+        with self._lock:
+            self._busy_time += done - t
+            self._frames += len(batch)
+            self._batch_sizes.append(len(batch))
+            for request in batch:
+                self._latencies.append(done - request.submit_time)
+                self._streams[request.stream] += 1
+        for request, result in zip(batch, results):
+            request.future.set_result(result)
+
+    def report(self):
+        """
+        Throughput and latency of the batched predictions so far
+        Returns:
+            dict with frame count, batch size and queue depth histograms, throughput and latency percentiles
+        """
+        with self._lock:
+            batch_sizes = list(self._batch_sizes)
+            queue_depths = list(self._queue_depths)
+            latencies = np.array(self._latencies) * 1000
+            return {
+                'frames': self._frames,
+                'batches': len(batch_sizes),
+                'mean_batch_size': round(float(np.mean(batch_sizes)), 2) if batch_sizes else 0.0,
+                'batch_size_histogram': dict(sorted(Counter(batch_sizes).items())),
+                'queue_depth': self.queue_depth(),
+                'active_streams': sum(seen >= time.time() - 1 for seen in self._stream_seen.values()),
+                'queue_depth_histogram': dict(sorted(Counter(queue_depths).items())),
+                'frames_per_s': round(self._frames / (time.time() - self._start_time), 2),
+                'model_frames_per_s': round(self._frames / self._busy_time, 2) if self._busy_time > 0 else 0.0,
+                'latency_p50_ms': round(float(np.percentile(latencies, 50)), 1) if len(latencies) else 0.0,
+                'latency_p95_ms': round(float(np.percentile(latencies, 95)), 1) if len(latencies) else 0.0,
+                'frames_per_stream': dict(self._streams),
+            }
+
+
+# held weakly: a batcher lives as long as a session streams through it, so models evicted from the registry are freed
+_live_batchers = weakref.WeakValueDictionary()
+_live_lock = threading.Lock()
+
+
+def get_live_batcher(model):
+    """
+    Process-wide BatchPredictor of a model for live streams, shared by every Streamlit session, so frames of
+    concurrent streams go through the model together. It is freed once no session uses it, a model reloaded by the
+    registry gets a new one. Batch size and deadline are set by the NIGHTJARS_LIVE_BATCH_SIZE and NIGHTJARS_LIVE_MAX_WAIT_MS
+    environment variables
+    Parameters:
+        model: ultralytics YOLOv8 model, as returned by model_registry.get_model
+    Returns:
+        BatchPredictor, use for_stream to tag the frames of each stream
+    """
+    with _live_lock:
+        batcher = _live_batchers.get(model.ckpt_path)
+        if batcher is None or batcher.model is not model:
+            batcher = BatchPredictor(model, batch_size=int(os.environ.get('NIGHTJARS_LIVE_BATCH_SIZE', 8)),
+                                     max_wait_ms=float(os.environ.get('NIGHTJARS_LIVE_MAX_WAIT_MS', 10)), min_streams=2)
+            _live_batchers[model.ckpt_path] = batcher
+        return batcher
+
+
+class _StreamPredictor:
+    def __init__(self, batcher, stream):
+        self.batcher = batcher
+        self.stream = stream
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__['batcher'], name)
+
+    def predict(self, source, **predict_kwargs):
+        return self.batcher.predict(source, stream=self.stream, **predict_kwargs)
+
+
+def benchmark_batching(model, frames, batch_sizes=(1, 2, 4, 8, 16), max_wait_ms=20):
+    """
+    Measure throughput against latency of batched prediction for several batch sizes
+    Parameters:
+        model: ultralytics YOLOv8 model
+        frames: list of image frames, submitted all at once for every batch size
+        batch_sizes: batch sizes to try
+        max_wait_ms: maximum time to wait for a batch to fill up
+    Returns:
+        list of report dicts, one per batch size
+    """
+    reports = []
+    for batch_size in batch_sizes:
+        batcher = BatchPredictor(model, batch_size=batch_size, max_wait_ms=max_wait_ms)
+        try:
+            batcher.predict(list(frames))
+            reports.append(dict(batch_size=batch_size, **batcher.report()))
+        finally:
+            batcher.close()
+    return reports
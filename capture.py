@@ -0,0 +1,327 @@
+import time
+import threading
+from collections import namedtuple
+
+import cv2
+
+# frame read from a capture, with its sequence number and the time it was read
+CapturedFrame = namedtuple('CapturedFrame', ['frame', 'seq', 'timestamp'])
+
+
+class LatestFrameCapture:
+    """
+    Read frames from a cv2.VideoCapture on a background thread and keep only the newest one
+    When processing is slower than the camera, older frames are overwritten instead of queueing up
+    in the capture buffer, so the consumer always works on a fresh frame and latency stays bounded
+    Parameters:
+        cap: opened cv2.VideoCapture, or any object with read() and release()
+        name: name of the capture thread
+    """
+    def __init__(self, cap, name='capture'):
+        self.cap = cap
+        self.name = name
+        self.dropped = 0
+        self.read_frames = 0
+        self._latest = None
+        self._last_returned_seq = 0
+        self._seq = 0
+        self._running = False
+        self._ended = False
+        self._condition = threading.Condition()
+        self._thread = None
+        if hasattr(cap, 'set'):
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            while self._running:
+                success, frame = self.cap.read()
+                if not success:
+                    self._end()
+                    break
+                self._publish(frame)
+        finally:
+            # the capture is only ever used and released on this thread
+            self.cap.release()
+
+    def _publish(self, frame):
+        with self._condition:
+            if self._latest is not None and self._latest.seq > self._last_returned_seq:
+                self.dropped += 1
+            self._seq += 1
+            self.read_frames += 1
+            self._latest = CapturedFrame(frame, self._seq, time.time())
+            self._condition.notify_all()
+
+    def _end(self):
+        with self._condition:
+            self._ended = True
+            self._condition.notify_all()
+
+    @property
+    def ended(self):
+        return self._ended
+
+    def read(self, timeout=None):
+        """
+        Wait for a frame newer than the last one returned
+        Parameters:
+            timeout: maximum time to wait in seconds, None to wait until a frame arrives or the capture ends
+        Returns:
+            CapturedFrame with frame, sequence number and capture timestamp, None if the capture ended or timed out
+        """
+        with self._condition:
+            has_new_frame = self._condition.wait_for(
+                lambda: (self._latest is not None and self._latest.seq > self._last_returned_seq) or self._ended or not self._running,
+                timeout=timeout)
+            if not has_new_frame or self._latest is None or self._latest.seq <= self._last_returned_seq:
+                return None
+            self._last_returned_seq = self._latest.seq
+            return self._latest
+
+    def stats(self):
+        """
+        Returns:
+            dict with number of frames read from the capture, dropped before being processed, and whether the capture ended
+        """
+        with self._condition:
+            return {'read': self.read_frames, 'dropped': self.dropped, 'ended': self._ended}
+
+    def stop(self, timeout=1):
+        """
+        Signal the capture thread to stop and wait up to `timeout` seconds for it, the thread releases the capture
+        once its current read returns, which can take longer than `timeout` on a stalled stream
+        """
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is None:
+            if self.cap is not None:
+                self.cap.release()
+            return
+        self._thread.join(timeout=timeout)
+
+
+class RateMeter:
+    """
+    Exponential moving average of an event rate
+    Parameters:
+        smoothing: weight of the newest interval, between 0 and 1
+    """
+    def __init__(self, smoothing=0.1):
+        self.smoothing = smoothing
+        self.rate = 0.0
+        self._last = None
+
+    def tick(self):
+        now = time.time()
+        if self._last is not None and now > self._last:
+            rate = 1 / (now - self._last)
+            self.rate = rate if self.rate == 0 else (1 - self.smoothing) * self.rate + self.smoothing * rate
+        self._last = now
+
+
+class RTSPSource(LatestFrameCapture):
+    """
+    Latest-frame capture of an RTSP stream that reconnects with exponential backoff and skips frames adaptively
+    Frames are grabbed at the stream rate but only every `skip`-th one is decoded. `skip` follows the ratio of
+    incoming fps to the fps the consumer can sustain, measured as the time between a frame returned by read()
+    and the next read() call, so decoding matches what inference keeps up with instead of falling behind
+    Parameters:
+        url: RTSP url, or anything capture_factory accepts
+        capture_factory: function opening a capture from the url, default cv2.VideoCapture, replace with FakeCapture for tests
+        backoff_initial: seconds to wait before the first reconnect attempt
+        backoff_max: maximum seconds to wait between reconnect attempts
+        max_reconnects: number of failed reconnect attempts in a row before giving up, None to retry forever
+        adaptive_skip: adjust the frame skip ratio to the processed fps, otherwise decode every frame
+        max_skip: maximum frame skip ratio
+    """
+    def __init__(self, url, capture_factory=cv2.VideoCapture, backoff_initial=0.5, backoff_max=30.0, max_reconnects=None,
+                 adaptive_skip=True, max_skip=30):
+        super().__init__(None, name=f'rtsp {url}')
+        self.url = url
+        self.capture_factory = capture_factory
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.max_reconnects = max_reconnects
+        self.adaptive_skip = adaptive_skip
+        self.max_skip = max_skip
+        self.skip = 1
+        self.reconnects = 0
+        self.connected = False
+        self._failed_attempts = 0
+        self._fps_in = RateMeter()
+        self._fps_processed = RateMeter()
+        self._processing_time = 0.0
+        self._returned_at = None
+
+    def read(self, timeout=None):
+        if self._returned_at is not None:
+            processing_time = time.time() - self._returned_at
+            self._processing_time = processing_time if self._processing_time == 0 else 0.9 * self._processing_time + 0.1 * processing_time
+        captured = super().read(timeout)
+        if captured is not None:
+            self._fps_processed.tick()
+        self._returned_at = time.time() if captured is not None else None
+        return captured
+
+    def _sleep(self, seconds):
+        with self._condition:
+            self._condition.wait_for(lambda: not self._running, timeout=seconds)
+
+    def _connect(self):
+        cap = self.capture_factory(self.url)
+        if cap is not None and cap.isOpened():
+            return cap
+        if cap is not None:
+            cap.release()
+        return None
+
+    def _disconnect(self):
+        self.connected = False
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+    def _attempt_failed(self):
+        # a connection attempt that did not deliver a frame, True once max_reconnects attempts failed in a row
+        self._failed_attempts += 1
+        return self.max_reconnects is not None and self._failed_attempts > self.max_reconnects
+
+    def _run(self):
+        backoff = self.backoff_initial
+        grabbed = 0
+        attempted = False
+        # a connection only counts as successful once it delivered a frame, a stream that opens
+        # but fails to grab is retried with backoff like one that refuses to open
+        delivered = False
+        try:
+            while self._running:
+                if self.cap is None:
+                    if attempted:
+                        self._sleep(backoff)
+                        backoff = min(backoff * 2, self.backoff_max)
+                        if not self._running:
+                            break
+                    attempted = True
+                    self.cap = self._connect()
+                    if self.cap is None:
+                        if self._attempt_failed():
+                            self._end()
+                            break
+                        continue
+                    if self.read_frames:
+                        self.reconnects += 1
+                    self.connected = True
+                    delivered = False
+                if not self.cap.grab():
+                    self._disconnect()
+                    if not delivered and self._attempt_failed():
+                        self._end()
+                        break
+                    continue
+                grabbed += 1
+                self._fps_in.tick()
+                if grabbed % self.skip:
+                    continue
+                success, frame = self.cap.retrieve()
+                if not success:
+                    self._disconnect()
+                    if not delivered and self._attempt_failed():
+                        self._end()
+                        break
+                    continue
+                if not delivered:
+                    delivered = True
+                    self._failed_attempts = 0
+                    backoff = self.backoff_initial
+                self._publish(frame)
+                if self.adaptive_skip and self._processing_time > 0:
+                    self.skip = int(min(max(round(self._fps_in.rate * self._processing_time), 1), self.max_skip))
+        finally:
+            self._disconnect()
+
+    def stats(self):
+        """
+        Returns:
+            dict with stream health: incoming and processed fps, frame skip ratio, reconnect count, read and dropped frames
+        """
+        stats = super().stats()
+        stats.update({
+            'connected': self.connected,
+            'fps_in': round(self._fps_in.rate, 2),
+            'fps_processed': round(self._fps_processed.rate, 2),
+            'skip': self.skip,
+            'reconnects': self.reconnects,
+        })
+        return stats
+
+
+class FakeCapture:
+    """
+    Local stand-in for an RTSP cv2.VideoCapture, plays a video file or a list of frames in a loop at a fixed rate
+    and can simulate a stream that drops after a number of frames or refuses connections
+    Parameters:
+        source: video file or list of frames
+        fps: playback rate, 0 to return frames as fast as they are asked for
+        fail_after: number of frames after which the stream drops, None to never drop
+        refuse: number of connection attempts to refuse before opening
+    """
+    def __init__(self, source, fps=25, fail_after=None, refuse=0):
+        if isinstance(source, str):
+            cap = cv2.VideoCapture(source)
+            source = []
+            while True:
+                success, frame = cap.read()
+                if not success:
+                    break
+                source.append(frame)
+            cap.release()
+        self.frames = source
+        self.fps = fps
+        self.fail_after = fail_after
+        self.refuse = refuse
+        self.attempts = 0
+        self.opened = False
+        self.index = 0
+        self._last = None
+
+    def __call__(self, url):
+        # used as capture_factory, each call is a new connection attempt
+        self.attempts += 1
+        self.opened = self.attempts > self.refuse and len(self.frames) > 0
+        self.index = 0
+        return self
+
+    def isOpened(self):
+        return self.opened
+
+    def grab(self):
+        if not self.opened or (self.fail_after is not None and self.index >= self.fail_after):
+            self.opened = False
+            return False
+        if self.fps and self._last is not None:
+            time.sleep(max(self._last + 1 / self.fps - time.time(), 0))
+        self._last = time.time()
+        self.index += 1
+        return True
+
+    def retrieve(self):
+        if not self.opened:
+            return False, None
+        return True, self.frames[(self.index - 1) % len(self.frames)]
+
+    def read(self):
+        return self.retrieve() if self.grab() else (False, None)
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        self.opened = False
@@ -0,0 +1,147 @@
+import io
+import json
+import gzip
+import time
+
+COMPRESSIONS = (None, 'gzip', 'zstd')
+EXTENSIONS = {None: '.ndjson', 'gzip': '.ndjson.gz', 'zstd': '.ndjson.zst'}
+_GZIP_MAGIC = b'\x1f\x8b'
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError('zstd compression needs the zstandard package, install it with pip install zstandard or use gzip')
+    return zstandard
+
+
+def log_path(path, compression=None):
+    """
+    Path of a detection log with the extension of its compression
+    Parameters:
+        path: output path, its extension is replaced
+        compression: None, 'gzip' or 'zstd'
+    Returns:
+        path ending in .ndjson, .ndjson.gz or .ndjson.zst
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"unknown compression '{compression}', expected one of {COMPRESSIONS}")
+    for extension in sorted(EXTENSIONS.values(), key=len, reverse=True) + ['.json']:
+        if path.endswith(extension):
+            path = path[:-len(extension)]
+            break
+    return path + EXTENSIONS[compression]
+
+
+class DetectionLogWriter:
+    """
+    Write detection results as newline-delimited JSON, one compact line per frame with its index and timestamp
+    Lines are buffered and written in chunks of about `flush_bytes`; every chunk is flushed through the compressor,
+    so the log can be read while it is still being written
+    Parameters:
+        path: output file
+        compression: None, 'gzip' or 'zstd' (needs the zstandard package)
+        flush_bytes: size of the buffered chunks
+    """
+    def __init__(self, path, compression=None, flush_bytes=1 << 20):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"unknown compression '{compression}', expected one of {COMPRESSIONS}")
+        self.path = path
+        self.compression = compression
+        self.flush_bytes = flush_bytes
+        self.frames = 0
+        self._buffer = []
+        self._buffered = 0
+        if compression == 'gzip':
+            self._file = gzip.open(path, 'wb')
+        elif compression == 'zstd':
+            self._raw = open(path, 'wb')
+            self._file = _zstandard().ZstdCompressor().stream_writer(self._raw)
+        else:
+            self._file = open(path, 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, frame_index, detections, timestamp=None):
+        """
+        Add the detections of one frame
+        Parameters:
+            frame_index: index of the frame in the video
+            detections: detection result in json format of the frame
+            timestamp: time of the frame in seconds, default is the current time
+        """
+        record = {'frame': frame_index, 'timestamp': round(time.time() if timestamp is None else timestamp, 3), 'detections': detections}
+        line = (json.dumps(record, separators=(',', ':')) + '\n').encode()
+        self._buffer.append(line)
+        self._buffered += len(line)
+        self.frames += 1
+        if self._buffered >= self.flush_bytes:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._file.write(b''.join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+        self._file.flush()
+
+    def close(self):
+        if self._file is None:
+            return
+        self.flush()
+        self._file.close()
+        if self.compression == 'zstd' and not self._raw.closed:
+            self._raw.close()
+        self._file = None
+
+
+def open_detection_log(path):
+    """
+    Open a detection log for reading, the compression is detected from the first bytes of the file
+    Parameters:
+        path: detection log file
+    Returns:
+        binary file object of the decompressed log
+    """
+    raw = open(path, 'rb')
+    magic = raw.read(4)
+    raw.seek(0)
+    if magic.startswith(_GZIP_MAGIC):
+        raw.close()
+        return gzip.open(path, 'rb')
+    if magic == _ZSTD_MAGIC:
+        return io.BufferedReader(_zstandard().ZstdDecompressor().stream_reader(raw, closefd=True))
+    return raw
+
+
+def read_detection_log(path, start_frame=None, end_frame=None):
+    """
+    Iterate lazily over the frames of a detection log, only one line is held in memory at a time
+    A last line that is not complete yet, because the log is still being written, is ignored
+    Parameters:
+        path: detection log file
+        start_frame: first frame index to return, None to start at the beginning
+        end_frame: frame index to stop before, None to read to the end
+    Returns:
+        generator of dict with frame index, timestamp and detections of each frame
+    """
+    with open_detection_log(path) as log:
+        try:
+            for line in log:
+                if not line.endswith(b'\n'):
+                    break
+                record = json.loads(line)
+                if start_frame is not None and record['frame'] < start_frame:
+                    continue
+                if end_frame is not None and record['frame'] >= end_frame:
+                    break
+                yield record
+        except EOFError:
+            # compressed stream that is not finished yet
+            return
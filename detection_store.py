@@ -0,0 +1,238 @@
+import os
+import json
+
+import numpy as np
+
+# column name: (dtype, shape of one row)
+COLUMNS = {
+    'frame': ('int64', ()),
+    'timestamp': ('float64', ()),
+    'track_id': ('int64', ()),
+    'class_id': ('int32', ()),
+    'conf': ('float32', ()),
+    'bbox': ('int32', (4,)),
+    'predicted': ('bool', ()),
+}
+# columns with a sorted index, as the row order and the keys in that order
+INDEXED = ('class_id', 'track_id')
+NO_TRACK = -1
+
+
+class DetectionStoreWriter:
+    """
+    Write detections of a video frame by frame into a columnar store, one flat binary file per column
+    Rows are appended in frame order, so frame and timestamp columns are sorted and searchable as they are;
+    class and track ID indexes are built when the writer is closed
+    Parameters:
+        store_dir: directory of the store, created if needed
+        chunk_rows: number of rows buffered in memory before they are appended to the column files
+    """
+    def __init__(self, store_dir, chunk_rows=65536):
+        os.makedirs(store_dir, exist_ok=True)
+        self.store_dir = store_dir
+        self.chunk_rows = chunk_rows
+        self.rows = 0
+        self.frames = 0
+        self.class_names = {}
+        self._buffer = {name: [] for name in COLUMNS}
+        self._files = {name: open(os.path.join(store_dir, f'{name}.bin'), 'wb') for name in COLUMNS}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, frame_index, detections, timestamp):
+        """
+        Add the detections of one frame
+        Parameters:
+            frame_index: index of the frame in the video, increasing from one call to the next
+            detections: detection result in json format of the frame
+            timestamp: time of the frame in seconds from the start of the video
+        """
+        for detection in detections:
+            bbox = detection['bbox']
+            self._buffer['frame'].append(frame_index)
+            self._buffer['timestamp'].append(timestamp)
+            self._buffer['track_id'].append(detection.get('object_id', NO_TRACK))
+            self._buffer['class_id'].append(detection['class_id'])
+            self._buffer['conf'].append(detection['confidence'])
+            self._buffer['bbox'].append((bbox['x_min'], bbox['y_min'], bbox['x_max'], bbox['y_max']))
+            self._buffer['predicted'].append(detection.get('predicted', False))
+            self.class_names.setdefault(detection['class_id'], detection['class'])
+        self.frames += 1
+        if len(self._buffer['frame']) >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        n_rows = len(self._buffer['frame'])
+        if not n_rows:
+            return
+        for name, (dtype, shape) in COLUMNS.items():
+            column = np.asarray(self._buffer[name], dtype=dtype).reshape((n_rows,) + shape)
+            self._files[name].write(column.tobytes())
+            self._buffer[name] = []
+        self.rows += n_rows
+
+    def close(self):
+        if self._files is None:
+            return
+        self.flush()
+        for file in self._files.values():
+            file.close()
+        self._files = None
+        for name in INDEXED:
+            dtype, shape = COLUMNS[name]
+            column = _load_column(self.store_dir, name, dtype, (self.rows,) + shape)
+            order = np.argsort(column, kind='stable')
+            np.asarray(order, dtype='int64').tofile(os.path.join(self.store_dir, f'{name}.order.bin'))
+            np.asarray(column[order]).tofile(os.path.join(self.store_dir, f'{name}.keys.bin'))
+        meta = {
+            'rows': self.rows,
+            'frames': self.frames,
+            'columns': {name: [dtype, list(shape)] for name, (dtype, shape) in COLUMNS.items()},
+            'indexed': list(INDEXED),
+            'class_names': {str(class_id): name for class_id, name in sorted(self.class_names.items())},
+        }
+        with open(os.path.join(self.store_dir, 'meta.json'), 'w') as file:
+            json.dump(meta, file, indent=2)
+
+
+def _load_column(store_dir, name, dtype, shape):
+    # np.memmap cannot map an empty file
+    if not shape[0]:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(os.path.join(store_dir, f'{name}.bin'), dtype=dtype, mode='r', shape=shape)
+
+
+def build_detection_store(records, store_dir):
+    """
+    Build a detection store from the records of a detection log
+    Parameters:
+        records: iterable of dict with frame index, timestamp and detections, e.g. read_detection_log(path)
+        store_dir: directory of the store
+    Returns:
+        DetectionStore opened on the new store
+    """
+    with DetectionStoreWriter(store_dir) as writer:
+        for record in records:
+            writer.write(record['frame'], record['detections'], record['timestamp'])
+    return DetectionStore(store_dir)
+
+
+class DetectionStore:
+    """
+    Read-only, memory-mapped columnar store of the detections of a video
+    Queries only touch the pages of the rows they select: frame and time ranges are binary searches on the sorted
+    frame and timestamp columns, class and track filters are binary searches on their sorted indexes
+    Parameters:
+        store_dir: directory written by DetectionStoreWriter
+    """
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'meta.json')) as file:
+            self.meta = json.load(file)
+        self.rows = self.meta['rows']
+        self.class_names = {int(class_id): name for class_id, name in self.meta['class_names'].items()}
+        self.columns = {
+            name: _load_column(store_dir, name, dtype, (self.rows,) + tuple(shape))
+            for name, (dtype, shape) in self.meta['columns'].items()
+        }
+        self._indexes = {}
+        for name in self.meta['indexed']:
+            dtype, _ = self.meta['columns'][name]
+            self._indexes[name] = (_load_column(store_dir, f'{name}.order', 'int64', (self.rows,)),
+                                   _load_column(store_dir, f'{name}.keys', dtype, (self.rows,)))
+
+    def __len__(self):
+        return self.rows
+
+    def class_id(self, class_name):
+        """
+        Class ID of a class name, as found in the store
+        """
+        for class_id, name in self.class_names.items():
+            if name == class_name:
+                return class_id
+        raise KeyError(f"class '{class_name}' not in detection store, known classes are {sorted(self.class_names.values())}")
+
+    def _range(self, column, start, end):
+        values = self.columns[column]
+        lo = 0 if start is None else int(np.searchsorted(values, start, side='left'))
+        hi = self.rows if end is None else int(np.searchsorted(values, end, side='left'))
+        return lo, max(hi, lo)
+
+    def _index_span(self, column, value):
+        _, keys = self._indexes[column]
+        return int(np.searchsorted(keys, value, side='left')), int(np.searchsorted(keys, value, side='right'))
+
+    def _lookup(self, column, value):
+        order, _ = self._indexes[column]
+        lo, hi = self._index_span(column, value)
+        return np.sort(order[lo:hi])
+
+    def rows_where(self, start_frame=None, end_frame=None, start_time=None, end_time=None, class_id=None, track_id=None,
+                   min_conf=None):
+        """
+        Row numbers of the detections matching all the given filters, in frame order
+        Parameters:
+            start_frame: first frame index, None for no lower bound
+            end_frame: frame index to stop before, None for no upper bound
+            start_time: first timestamp in seconds, None for no lower bound
+            end_time: timestamp to stop before, None for no upper bound
+            class_id: class ID or class name
+            track_id: track ID
+            min_conf: minimum confidence
+        Returns:
+            rows: int64 array of row numbers
+        """
+        lo, hi = self._range('frame', start_frame, end_frame)
+        time_lo, time_hi = self._range('timestamp', start_time, end_time)
+        lo = max(lo, time_lo)
+        hi = max(min(hi, time_hi), lo)
+        if isinstance(class_id, str):
+            class_id = self.class_id(class_id)
+        filters = {column: value for column, value in (('class_id', class_id), ('track_id', track_id)) if value is not None}
+        # start from whichever is smaller, the frame range or the index entries of the most selective filter
+        spans = {column: self._index_span(column, value) for column, value in filters.items()}
+        narrowest = min(spans, key=lambda column: spans[column][1] - spans[column][0], default=None)
+        if narrowest is not None and spans[narrowest][1] - spans[narrowest][0] < hi - lo:
+            rows = self._lookup(narrowest, filters.pop(narrowest))
+            rows = rows[(rows >= lo) & (rows < hi)]
+        else:
+            rows = np.arange(lo, hi, dtype='int64')
+        for column, value in filters.items():
+            rows = rows[self.columns[column][rows] == value]
+        if min_conf is not None:
+            rows = rows[self.columns['conf'][rows] >= min_conf]
+        return rows
+
+    def query(self, columns=None, **filters):
+        """
+        Columns of the detections matching the filters of rows_where
+        Parameters:
+            columns: names of the columns to return, default all
+            filters: keyword filters of rows_where
+        Returns:
+            dict of column name to array of the matching rows
+        """
+        rows = self.rows_where(**filters)
+        return {name: np.asarray(self.columns[name][rows]) for name in (columns or self.columns)}
+
+    def count(self, unique_tracks=False, **filters):
+        """
+        Number of detections matching the filters, or of distinct tracked objects among them
+        e.g. count(unique_tracks=True, class_id='person', start_time=120, end_time=130)
+        """
+        rows = self.rows_where(**filters)
+        if not unique_tracks:
+            return len(rows)
+        track_ids = self.columns['track_id'][rows]
+        return len(np.unique(track_ids[track_ids != NO_TRACK]))
+
+    def track_frames(self, track_id):
+        """
+        Frame indexes in which a track appears
+        """
+        return np.unique(self.columns['frame'][self._lookup('track_id', track_id)])
@@ -0,0 +1,135 @@
+import os
+import uuid
+import shutil
+import subprocess
+from fractions import Fraction
+
+import numpy as np
+
+
+class FFmpegPipeWriter:
+    """
+    Encode BGR frames to H.264 by streaming raw frames to a single ffmpeg process over stdin
+    Same write/release interface as cv2.VideoWriter
+    Parameters:
+        path: output video file
+        width: frame width
+        height: frame height
+        fps: frame rate of the output video
+        preset: x264 encoder preset, from ultrafast to veryslow
+        threads: number of encoder threads, 0 lets ffmpeg decide
+        crf: x264 constant rate factor, None keeps the ffmpeg default
+    """
+    def __init__(self, path, width, height, fps=30, preset='medium', threads=0, crf=None):
+        if shutil.which('ffmpeg') is None:
+            raise RuntimeError('ffmpeg executable not found, install ffmpeg or use the pyav encoder')
+        self.path = path
+        self.frame_size = (width, height)
+        args = [
+            'ffmpeg', '-y', '-loglevel', 'error', '-nostats',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+            '-an', '-c:v', 'libx264', '-preset', preset, '-threads', str(threads), '-pix_fmt', 'yuv420p',
+        ]
+        if crf is not None:
+            args += ['-crf', str(crf)]
+        args += ['-movflags', '+faststart', '-f', 'mp4', path]
+        self.process = subprocess.Popen(args, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def write(self, frame):
+        if (frame.shape[1], frame.shape[0]) != self.frame_size:
+            raise ValueError(f'frame size {frame.shape[1]}x{frame.shape[0]} does not match video size {self.frame_size[0]}x{self.frame_size[1]}')
+        try:
+            self.process.stdin.write(np.ascontiguousarray(frame, dtype=np.uint8).data)
+        except BrokenPipeError:
+            _, stderr = self.process.communicate()
+            raise RuntimeError(f'ffmpeg stopped encoding {self.path}: {stderr.decode(errors="replace").strip()}')
+
+    def release(self):
+        if self.process.stdin.closed:
+            return
+        _, stderr = self.process.communicate()
+        if self.process.returncode != 0:
+            raise RuntimeError(f'ffmpeg failed to encode {self.path}: {stderr.decode(errors="replace").strip()}')
+
+
+class PyAVWriter:
+    """
+    Encode BGR frames to H.264 in process through PyAV
+    Same write/release interface as cv2.VideoWriter
+    Parameters:
+        path: output video file
+        width: frame width
+        height: frame height
+        fps: frame rate of the output video
+        preset: x264 encoder preset, from ultrafast to veryslow
+        threads: number of encoder threads, 0 lets the encoder decide
+        crf: x264 constant rate factor, None keeps the encoder default
+    """
+    def __init__(self, path, width, height, fps=30, preset='medium', threads=0, crf=None):
+        import av
+        self._av = av
+        self.path = path
+        self.container = av.open(path, mode='w')
+        # NTSC rates such as 29.97 are kept exact instead of being rounded
+        self.stream = self.container.add_stream('libx264', rate=Fraction(fps).limit_denominator(1001))
+        self.stream.width = width
+        self.stream.height = height
+        self.stream.pix_fmt = 'yuv420p'
+        self.stream.thread_count = threads
+        self.stream.options = {'preset': preset}
+        if crf is not None:
+            self.stream.options['crf'] = str(crf)
+
+    def write(self, frame):
+        video_frame = self._av.VideoFrame.from_ndarray(np.ascontiguousarray(frame), format='bgr24')
+        for packet in self.stream.encode(video_frame):
+            self.container.mux(packet)
+
+    def release(self):
+        if self.container is None:
+            return
+        for packet in self.stream.encode():
+            self.container.mux(packet)
+        self.container.close()
+        self.container = None
+
+
+ENCODERS = {
+    'ffmpeg': FFmpegPipeWriter,
+    'pyav': PyAVWriter,
+}
+
+
+def make_video_writer(path, width, height, fps=30, encoder='ffmpeg', preset='medium', threads=0, crf=None):
+    """
+    Open a H.264 video writer
+    Parameters:
+        path: output video file
+        width: frame width
+        height: frame height
+        fps: frame rate of the output video
+        encoder: 'ffmpeg' to pipe frames to an ffmpeg process, 'pyav' to encode through PyAV
+        preset: x264 encoder preset
+        threads: number of encoder threads, 0 lets the encoder decide
+        crf: x264 constant rate factor
+    Returns:
+        video writer with write(frame) and release()
+    """
+    if encoder not in ENCODERS:
+        raise ValueError(f"unknown encoder '{encoder}', expected one of {list(ENCODERS)}")
+    return ENCODERS[encoder](path, width, height, fps=fps, preset=preset, threads=threads, crf=crf)
+
+
+def job_path(path, job_id=None):
+    """
+    Unique path next to `path` for a single job, e.g. out.mp4 -> out.3f2a9c1e.partial.mp4
+    Each job writes there and moves the file to `path` once it is complete, so concurrent
+    jobs never write into the same file
+    Parameters:
+        path: final output file
+        job_id: identifier of the job, a random one is generated if it is not provided
+    Returns:
+        job_file: path of the job's own working file
+    """
+    root, ext = os.path.splitext(path)
+    return f"{root}.{job_id or uuid.uuid4().hex[:8]}.partial{ext}"
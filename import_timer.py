@@ -0,0 +1,48 @@
+import sys
+import time
+import builtins
+import threading
+from collections import OrderedDict
+
+_original_import = builtins.__import__
+_state = threading.local()
+_lock = threading.Lock()
+_timings = OrderedDict()
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    root = name.split('.')[0]
+    # only the outermost import of a module that is not loaded yet is timed, nested imports count towards it
+    if level or getattr(_state, 'depth', 0) or root in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+    _state.depth = 1
+    t = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.perf_counter() - t
+        _state.depth = 0
+        with _lock:
+            _timings[root] = _timings.get(root, 0.0) + elapsed
+
+
+def install():
+    """
+    Start recording how long the first import of each top-level module takes, safe to call on every rerun
+    """
+    builtins.__import__ = _timed_import
+
+
+def uninstall():
+    builtins.__import__ = _original_import
+
+
+def import_report():
+    """
+    Time spent importing each top-level module since install(), slowest first
+    Returns:
+        list of dict with module name and import time in ms
+    """
+    with _lock:
+        timings = sorted(_timings.items(), key=lambda item: item[1], reverse=True)
+    return [{'module': module, 'import_ms': round(elapsed * 1000, 1)} for module, elapsed in timings]
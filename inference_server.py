@@ -0,0 +1,193 @@
+import json
+import time
+import argparse
+import threading
+from collections import deque
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+from batching import BatchPredictor
+from mask_codec import MASK_FORMATS
+
+
+class InferenceService:
+    """
+    Detection service shared by the request handler threads
+    Every request submits its image to one BatchPredictor, which forms dynamic batches across concurrent requests;
+    requests beyond `max_queue` waiting images are rejected, so overload shows up as 503s instead of growing latency
+    Parameters:
+        model: ultralytics YOLOv8 model
+        batch_size: maximum number of images in one forward pass
+        max_wait_ms: maximum time a batch waits to fill up
+        max_queue: maximum number of images waiting for a batch
+        history: number of recent requests kept for the latency report
+    """
+    def __init__(self, model, batch_size=8, max_wait_ms=10, max_queue=64, history=1000):
+        self.batcher = BatchPredictor(model, batch_size=batch_size, max_wait_ms=max_wait_ms)
+        self.max_queue = max_queue
+        self.requests = 0
+        self.rejected = 0
+        self.errors = 0
+        self.in_flight = 0
+        self._latencies = deque(maxlen=history)
+        self._lock = threading.Lock()
+
+    def detect(self, image_bytes, mask_format='rle', stream=None):
+        """
+        Detect objects in an encoded image
+        Parameters:
+            image_bytes: encoded image file content
+            mask_format: encoding of object masks, see result_to_json
+            stream: name of the client, used for the per-source report
+        Returns:
+            result_list_json: detection result in json format, None when the queue is full
+        """
+        from processing import result_to_json
+        frame = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError('request body is not a decodable image')
+        with self._lock:
+            self.requests += 1
+            if self.batcher.queue_depth() >= self.max_queue:
+                self.rejected += 1
+                return None
+            self.in_flight += 1
+        t = time.time()
+        try:
+            result = self.batcher.submit(frame, stream=stream).result()
+            return result_to_json(result, mask_format=mask_format)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self._latencies.append(time.time() - t)
+
+    def metrics(self):
+        """
+        Returns:
+            dict with request counts, in-flight requests, request latency percentiles and the batcher report,
+            which holds the queue depth and the batch size and queue depth histograms
+        """
+        with self._lock:
+            latencies = np.array(self._latencies) * 1000
+            metrics = {
+                'requests': self.requests,
+                'rejected': self.rejected,
+                'errors': self.errors,
+                'in_flight': self.in_flight,
+                'request_latency_p50_ms': round(float(np.percentile(latencies, 50)), 1) if len(latencies) else 0.0,
+                'request_latency_p95_ms': round(float(np.percentile(latencies, 95)), 1) if len(latencies) else 0.0,
+            }
+        metrics.update(self.batcher.report())
+        metrics['frames_per_stream'] = {str(stream): count for stream, count in metrics['frames_per_stream'].items()}
+        return metrics
+
+    def close(self):
+        self.batcher.close()
+
+
+class InferenceServer(ThreadingHTTPServer):
+    # one thread per connection, with a listen backlog large enough for bursts of concurrent clients
+    daemon_threads = True
+    request_queue_size = 256
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    """
+    POST /detect with an encoded image as body returns the detection result in json format,
+    optional query parameters mask_format and stream. GET /metrics and GET /health return json
+    """
+    service = None
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/metrics':
+            self._send_json(200, self.service.metrics())
+        elif path == '/health':
+            self._send_json(200, {'status': 'ok', 'model': self.service.batcher.ckpt_path})
+        else:
+            self._send_json(404, {'error': f'unknown path {path}'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/detect':
+            self._send_json(404, {'error': f'unknown path {url.path}'})
+            return
+        query = parse_qs(url.query)
+        mask_format = query.get('mask_format', ['rle'])[0]
+        if mask_format not in MASK_FORMATS:
+            self._send_json(400, {'error': f"unknown mask format '{mask_format}', expected one of {MASK_FORMATS}"})
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        if not length:
+            self._send_json(400, {'error': 'empty request body, send the encoded image as body'})
+            return
+        image_bytes = self.rfile.read(length)
+        try:
+            result_list_json = self.service.detect(image_bytes, mask_format=mask_format, stream=query.get('stream', [None])[0])
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        except Exception as e:
+            self._send_json(500, {'error': repr(e)})
+            return
+        if result_list_json is None:
+            self._send_json(503, {'error': 'inference queue is full, retry later'})
+            return
+        self._send_json(200, result_list_json)
+
+    def log_message(self, format, *args):
+        # one line per request would dominate the output under load
+        pass
+
+
+def serve(model, host='127.0.0.1', port=8000, batch_size=8, max_wait_ms=10, max_queue=64):
+    """
+    Run the inference service until interrupted
+    Parameters:
+        model: ultralytics YOLOv8 model
+        host: address to listen on
+        port: port to listen on
+        batch_size: maximum number of images in one forward pass
+        max_wait_ms: maximum time a batch waits to fill up
+        max_queue: maximum number of images waiting for a batch
+    """
+    service = InferenceService(model, batch_size=batch_size, max_wait_ms=max_wait_ms, max_queue=max_queue)
+    handler = type('Handler', (InferenceHandler,), {'service': service})
+    server = InferenceServer((host, port), handler)
+    print(f"Serving {model.ckpt_path} on http://{host}:{port} (POST /detect, GET /metrics, GET /health)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='HTTP inference service with dynamic request batching')
+    parser.add_argument('--model', type=str, default='yolov8xcdark.pt', help='model checkpoint')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8000, help='port to listen on')
+    parser.add_argument('--batch-size', type=int, default=8, help='maximum images per forward pass')
+    parser.add_argument('--max-wait-ms', type=int, default=10, help='maximum time a batch waits to fill up')
+    parser.add_argument('--max-queue', type=int, default=64, help='maximum images waiting, further requests get 503')
+    opt = parser.parse_args()
+    from model_registry import get_model
+    serve(get_model(opt.model), host=opt.host, port=opt.port, batch_size=opt.batch_size, max_wait_ms=opt.max_wait_ms,
+          max_queue=opt.max_queue)
@@ -0,0 +1,106 @@
+import base64
+
+import numpy as np
+
+MASK_FORMATS = ('full', 'rle', 'bitpacked')
+
+
+def encode_rle(mask):
+    """
+    Encode binary mask to COCO-style uncompressed run-length encoding
+    Runs are counted in column-major order and start with a run of zeros
+    Parameters:
+        mask: (h, w) array, non-zero pixels belong to the object
+    Returns:
+        rle: dict with 'size' [h, w] and 'counts' list of run lengths
+    """
+    pixels = np.asarray(mask, dtype=bool).ravel(order='F')
+    changes = np.flatnonzero(pixels[1:] != pixels[:-1]) + 1
+    boundaries = np.concatenate([[0], changes, [pixels.size]])
+    counts = np.diff(boundaries)
+    if pixels.size and pixels[0]:
+        counts = np.concatenate([[0], counts])
+    return {'size': [int(mask.shape[0]), int(mask.shape[1])], 'counts': counts.tolist()}
+
+
+def decode_rle(rle):
+    """
+    Decode COCO-style uncompressed run-length encoding to binary mask
+    Parameters:
+        rle: dict with 'size' [h, w] and 'counts' list of run lengths
+    Returns:
+        mask: (h, w) uint8 array of 0 and 1
+    """
+    h, w = rle['size']
+    counts = np.asarray(rle['counts'], dtype=np.int64)
+    values = np.arange(len(counts), dtype=np.uint8) % 2
+    return np.repeat(values, counts).reshape((h, w), order='F')
+
+
+def encode_bitpacked(mask, bbox):
+    """
+    Encode binary mask as bit-packed array cropped to the bounding box of the object
+    Parameters:
+        mask: (h, w) array, non-zero pixels belong to the object
+        bbox: dict with x_min, y_min, x_max, y_max of the object
+    Returns:
+        encoded: dict with 'size' [h, w] of the full mask, 'box' [x_min, y_min, x_max, y_max] of the crop and base64 'bits'
+    """
+    h, w = mask.shape[:2]
+    x_min, y_min = max(int(bbox['x_min']), 0), max(int(bbox['y_min']), 0)
+    x_max, y_max = min(int(bbox['x_max']), w), min(int(bbox['y_max']), h)
+    crop = np.asarray(mask[y_min:y_max, x_min:x_max], dtype=bool)
+    return {
+        'size': [int(h), int(w)],
+        'box': [x_min, y_min, x_max, y_max],
+        'bits': base64.b64encode(np.packbits(crop).tobytes()).decode('ascii'),
+    }
+
+
+def decode_bitpacked(encoded):
+    """
+    Decode bit-packed bounding box cropped mask to full size binary mask
+    Parameters:
+        encoded: dict with 'size', 'box' and 'bits' as produced by encode_bitpacked
+    Returns:
+        mask: (h, w) uint8 array of 0 and 1
+    """
+    h, w = encoded['size']
+    x_min, y_min, x_max, y_max = encoded['box']
+    mask = np.zeros((h, w), dtype=np.uint8)
+    crop_h, crop_w = max(y_max - y_min, 0), max(x_max - x_min, 0)
+    bits = np.frombuffer(base64.b64decode(encoded['bits']), dtype=np.uint8)
+    mask[y_min:y_max, x_min:x_max] = np.unpackbits(bits, count=crop_h * crop_w).reshape(crop_h, crop_w)
+    return mask
+
+
+def encode_mask(mask, mask_format='full', bbox=None):
+    """
+    Encode object mask for detection json
+    Parameters:
+        mask: (h, w) float array of mask values in [0, 1], thresholded at 0.5 for the compact formats
+        mask_format: 'full' for nested lists of mask values, 'rle' for run-length encoding, 'bitpacked' for bounding box cropped bits
+        bbox: dict with x_min, y_min, x_max, y_max of the object, needed by 'bitpacked'
+    Returns:
+        encoded mask
+    """
+    if mask_format == 'full':
+        return mask.tolist()
+    if mask_format == 'rle':
+        return encode_rle(mask > 0.5)
+    if mask_format == 'bitpacked':
+        return encode_bitpacked(mask > 0.5, bbox)
+    raise ValueError(f"unknown mask format '{mask_format}', expected one of {MASK_FORMATS}")
+
+
+def decode_mask(encoded):
+    """
+    Decode object mask from detection json, whatever format it was encoded in
+    Parameters:
+        encoded: mask as produced by encode_mask
+    Returns:
+        mask: (h, w) array of mask values
+    """
+    if isinstance(encoded, dict):
+        return decode_bitpacked(encoded) if 'bits' in encoded else decode_rle(encoded)
+    return np.array(encoded)
@@ -0,0 +1,155 @@
+import os
+import copy
+import time
+import threading
+from collections import OrderedDict
+
+
+def model_size_mb(model, checkpoint=None):
+    """
+    Approximate memory footprint of a loaded model
+    Parameters:
+        model: ultralytics YOLOv8 model
+        checkpoint: checkpoint file, its size is used when the parameters cannot be inspected
+    Returns:
+        size in MB
+    """
+    try:
+        n_bytes = sum(p.numel() * p.element_size() for p in model.model.parameters())
+        n_bytes += sum(b.numel() * b.element_size() for b in model.model.buffers())
+    except AttributeError:
+        n_bytes = os.path.getsize(checkpoint) if checkpoint and os.path.exists(checkpoint) else 0
+    return n_bytes / 2 ** 20
+
+
+class SharedModel:
+    """
+    Thread-safe view of an ultralytics YOLOv8 model shared by every session and thread of the process
+    YOLO.predict keeps its settings (imgsz, ...) and data loader on a predictor object reused by later calls, so
+    concurrent calls would interfere and one caller's settings would carry over to the next. Calls are serialized
+    on a per-model lock, and each set of predict arguments gets its own predictor, all sharing the same weights.
+    Other attributes (ckpt_path, names, model, ...) are taken from the wrapped model
+    Parameters:
+        model: ultralytics YOLOv8 model
+    """
+    def __init__(self, model):
+        self.yolo = model
+        self._lock = threading.Lock()
+        self._predictors = {}
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__['yolo'], name)
+
+    def predict(self, source, **predict_kwargs):
+        """
+        model.predict, serialized with every other call on this model
+        Returns:
+            list of Results from ultralytics YOLOv8 prediction
+        """
+        key = tuple(sorted(predict_kwargs.items()))
+        with self._lock:
+            if key not in self._predictors:
+                # a shallow copy shares the weights, its predictor is built on its first call
+                predictor = copy.copy(self.yolo)
+                predictor.predictor = None
+                self._predictors[key] = predictor
+            return self._predictors[key].predict(source, **predict_kwargs)
+
+
+def load_yolo(checkpoint):
+    from ultralytics import YOLO
+    return SharedModel(YOLO(checkpoint))
+
+
+class ModelRegistry:
+    """
+    Process-wide store of loaded models, each checkpoint is loaded once on first use and shared by every caller
+    When the total size of the loaded models goes over `memory_budget_mb`, the least recently used models are
+    dropped from the registry; callers still holding a model keep it alive until they release it
+    Parameters:
+        memory_budget_mb: maximum total size of the loaded models, None for no limit
+        loader: function loading a model from a checkpoint, default loads an ultralytics YOLO model
+    """
+    def __init__(self, memory_budget_mb=None, loader=load_yolo):
+        self.memory_budget_mb = memory_budget_mb
+        self.loader = loader
+        self._models = OrderedDict()
+        self._sizes = {}
+        self._load_times = {}
+        self._lock = threading.Lock()
+        self._loading = {}
+
+    def get(self, checkpoint):
+        """
+        Get a loaded model, loading it if no caller has loaded it yet
+        Parameters:
+            checkpoint: model checkpoint file
+        Returns:
+            model: loaded model
+        """
+        with self._lock:
+            if checkpoint in self._models:
+                self._models.move_to_end(checkpoint)
+                return self._models[checkpoint]
+            load_lock = self._loading.setdefault(checkpoint, threading.Lock())
+        # only one caller loads a given checkpoint, the others wait for it
+        with load_lock:
+            with self._lock:
+                if checkpoint in self._models:
+                    self._models.move_to_end(checkpoint)
+                    return self._models[checkpoint]
+            t = time.time()
+            model = self.loader(checkpoint)
+            load_time = time.time() - t
+            with self._lock:
+                self._models[checkpoint] = model
+                self._sizes[checkpoint] = model_size_mb(model, checkpoint)
+                self._load_times[checkpoint] = load_time
+                self._loading.pop(checkpoint, None)
+                self._evict(keep=checkpoint)
+            print(f"Loaded {checkpoint} in {load_time:.2f}s ({self._sizes.get(checkpoint, 0):.1f} MB)")
+            return model
+
+    def _evict(self, keep=None):
+        if self.memory_budget_mb is None:
+            return
+        for checkpoint in list(self._models):
+            if sum(self._sizes.values()) <= self.memory_budget_mb:
+                break
+            if checkpoint == keep:
+                continue
+            del self._models[checkpoint]
+            del self._sizes[checkpoint]
+            print(f"Evicted {checkpoint} from model registry (memory budget {self.memory_budget_mb} MB)")
+
+    def evict(self, checkpoint):
+        with self._lock:
+            self._models.pop(checkpoint, None)
+            self._sizes.pop(checkpoint, None)
+
+    def loaded(self):
+        """
+        Models currently held by the registry, least recently used first
+        Returns:
+            list of dict with checkpoint, size and load time of each model
+        """
+        with self._lock:
+            return [
+                {'checkpoint': checkpoint, 'size_mb': round(self._sizes[checkpoint], 1), 'load_s': round(self._load_times[checkpoint], 2)}
+                for checkpoint in self._models
+            ]
+
+
+# shared by every Streamlit session of the process, module state survives script reruns
+registry = ModelRegistry(memory_budget_mb=float(os.environ['NIGHTJARS_MODEL_BUDGET_MB']) if os.environ.get('NIGHTJARS_MODEL_BUDGET_MB') else None)
+
+
+def get_model(checkpoint):
+    """
+    Get a model from the process-wide registry, loading it on first use
+    Parameters:
+        checkpoint: model checkpoint file
+    Returns:
+        model: SharedModel wrapping the ultralytics YOLOv8 model, safe to use from several threads
+    """
+    return registry.get(checkpoint)
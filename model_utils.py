@@ -1,6 +1,10 @@
-from utils.plots import plot_one_box
-from PIL import ImageColor
+import os
+import time
+import shutil
+import threading
 import subprocess
+from collections import deque
+
 import streamlit as st
 import psutil
 
@@ -15,7 +19,116 @@ def get_gpu_memory():
     return gpu_memory[0]
 
 
-def get_system_stat(stframe1, stframe2, fps):
+def probe_gpu():
+    """
+    Check once whether GPU memory can be queried, so CPU-only machines never spawn nvidia-smi again
+    Returns:
+        True if nvidia-smi is installed and answers
+    """
+    if shutil.which('nvidia-smi') is None:
+        return False
+    try:
+        get_gpu_memory()
+    except (subprocess.CalledProcessError, OSError, ValueError):
+        return False
+    return True
+
+
+class SystemSampler:
+    """
+    Sample CPU, memory, process RSS and, when available, GPU memory on a background thread every `interval` seconds
+    Samples are kept in a ring buffer of `history` entries, readers only look at the buffer, so the cost of
+    sampling does not depend on how often statistics are displayed
+    Parameters:
+        interval: seconds between two samples
+        history: number of samples kept
+    """
+    def __init__(self, interval=1.0, history=300):
+        self.interval = interval
+        self.samples = deque(maxlen=history)
+        self.gpu_available = probe_gpu()
+        self._process = psutil.Process(os.getpid())
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        # the first cpu_percent call only sets the reference point
+        psutil.cpu_percent(interval=None)
+        self._thread = threading.Thread(target=self._run, name='system sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def sample(self):
+        """
+        Take one sample
+        Returns:
+            dict with time, cpu_percent, memory_percent, rss_mb and gpu_memory_mb (None without GPU)
+        """
+        gpu_memory = None
+        if self.gpu_available:
+            try:
+                gpu_memory = get_gpu_memory()
+            except (subprocess.CalledProcessError, OSError, ValueError):
+                gpu_memory = None
+        return {
+            'time': time.time(),
+            'cpu_percent': psutil.cpu_percent(interval=None),
+            'memory_percent': psutil.virtual_memory().percent,
+            'rss_mb': round(self._process.memory_info().rss / 2 ** 20, 1),
+            'gpu_memory_mb': gpu_memory,
+        }
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.samples.append(self.sample())
+            self._stop.wait(self.interval)
+
+    def latest(self):
+        """
+        Returns:
+            most recent sample, None before the first one
+        """
+        return self.samples[-1] if self.samples else None
+
+    def history(self):
+        """
+        Returns:
+            list of samples, oldest first
+        """
+        return list(self.samples)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def get_sampler():
+    """
+    Process-wide system sampler, started on first use and shared by every Streamlit session
+    """
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = SystemSampler().start()
+        return _sampler
+
+
+def get_system_stat(stframe1, stframe2, fps, sample=None):
+    """
+    Display inference and system statistics
+    Parameters:
+        stframe1: Streamlit container of the inference statistics
+        stframe2: Streamlit container of the system statistics
+        fps: frame rate
+        sample: SystemSampler sample to display, default the latest sample of the process-wide sampler
+    """
+    if sample is None:
+        sample = get_sampler().latest() or get_sampler().sample()
     # Updating Inference results
     with stframe1.container():
         st.markdown("<h2>Inference Statistics</h2>", unsafe_allow_html=True)
@@ -23,31 +136,66 @@ def get_system_stat(stframe1, stframe2, fps):
             st.markdown(f"<h4 style='color:green;'>Frame Rate: {round(fps, 4)}</h4>", unsafe_allow_html=True)
         else:
             st.markdown(f"<h4 style='color:blue;'>Frame Rate: {round(fps, 4)}</h4>", unsafe_allow_html=True)
-    
+
     with stframe2.container():
         st.markdown("<h2>System Statistics</h2>", unsafe_allow_html=True)
-        js1, js2, js3 = st.columns(3)                       
+        js1, js2, js3 = st.columns(3)
 
         # Updating System stats
         with js1:
             st.markdown("<h4>Memory usage</h4>", unsafe_allow_html=True)
-            mem_use = psutil.virtual_memory()[2]
+            mem_use = sample['memory_percent']
             if mem_use > 50:
-                js1_text = st.markdown(f"<h5 style='color:blue;'>{mem_use}%</h5>", unsafe_allow_html=True)
+                js1_text = st.markdown(f"<h5 style='color:blue;'>{mem_use}% ({sample['rss_mb']} MB process)</h5>", unsafe_allow_html=True)
             else:
-                js1_text = st.markdown(f"<h5 style='color:green;'>{mem_use}%</h5>", unsafe_allow_html=True)
+                js1_text = st.markdown(f"<h5 style='color:green;'>{mem_use}% ({sample['rss_mb']} MB process)</h5>", unsafe_allow_html=True)
 
         with js2:
             st.markdown("<h4>CPU Usage</h4>", unsafe_allow_html=True)
-            cpu_use = psutil.cpu_percent()
-            if mem_use > 50:
+            cpu_use = sample['cpu_percent']
+            if cpu_use > 50:
                 js2_text = st.markdown(f"<h5 style='color:red;'>{cpu_use}%</h5>", unsafe_allow_html=True)
             else:
                 js2_text = st.markdown(f"<h5 style='color:green;'>{cpu_use}%</h5>", unsafe_allow_html=True)
 
         with js3:
-            st.markdown("<h4>GPU Memory Usage</h4>", unsafe_allow_html=True)  
-            try:
-                js3_text = st.markdown(f'<h5>{get_gpu_memory()} MB</h5>', unsafe_allow_html=True)
-            except:
+            st.markdown("<h4>GPU Memory Usage</h4>", unsafe_allow_html=True)
+            if sample['gpu_memory_mb'] is not None:
+                js3_text = st.markdown(f"<h5>{sample['gpu_memory_mb']} MB</h5>", unsafe_allow_html=True)
+            else:
                 js3_text = st.markdown('<h5>NA</h5>', unsafe_allow_html=True)
+
+
+class SystemStatView:
+    """
+    Statistics display of a live loop, refreshed from the sampler at most every `refresh_s` seconds
+    instead of on every frame; the frame rate shown is averaged over the frames in between
+    Parameters:
+        stframe1: Streamlit container of the inference statistics
+        stframe2: Streamlit container of the system statistics
+        refresh_s: minimum seconds between two refreshes
+        sampler: SystemSampler, default the process-wide sampler
+    """
+    def __init__(self, stframe1, stframe2, refresh_s=1.0, sampler=None):
+        self.stframe1 = stframe1
+        self.stframe2 = stframe2
+        self.refresh_s = refresh_s
+        self.sampler = sampler or get_sampler()
+        self._frames = 0
+        self._last = time.time()
+
+    def update(self, frames=1):
+        """
+        Count processed frames and refresh the display when it is due
+        Parameters:
+            frames: number of frames processed since the last call
+        """
+        self._frames += frames
+        now = time.time()
+        if now - self._last < self.refresh_s:
+            return
+        fps = self._frames / (now - self._last)
+        self._frames = 0
+        self._last = now
+        sample = self.sampler.latest() or self.sampler.sample()
+        get_system_stat(self.stframe1, self.stframe2, fps, sample)
@@ -0,0 +1,146 @@
+import time
+import queue
+import threading
+
+# end-of-stream marker passed between stages
+_END = object()
+
+
+class StageStats:
+    """
+    Throughput counters of a single pipeline stage
+    Parameters:
+        name: name of the stage
+    """
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy_time = 0.0
+        self.start_time = None
+        self.end_time = None
+
+    def as_dict(self):
+        wall_time = (self.end_time or time.time()) - (self.start_time or time.time())
+        return {
+            'stage': self.name,
+            'items': self.items,
+            'busy_s': round(self.busy_time, 4),
+            'wall_s': round(wall_time, 4),
+            'items_per_s': round(self.items / self.busy_time, 2) if self.busy_time > 0 else 0.0,
+            'utilization': round(self.busy_time / wall_time, 4) if wall_time > 0 else 0.0,
+        }
+
+
+class Pipeline:
+    """
+    Run a chain of stages on separate threads connected by bounded queues, keeping item order
+    Each stage is a (name, function) pair, the function takes one item and returns the item for the next stage.
+    The output of the last stage is yielded by iterating over the pipeline on the calling thread, so UI
+    updates such as progress bars can stay on the caller's thread.
+    Parameters:
+        source: iterable producing the input items, consumed on its own thread
+        stages: list of (name, function) pairs
+        queue_size: maximum number of items waiting between two consecutive stages
+        source_name: name reported for the source stage
+    """
+    def __init__(self, source, stages, queue_size=8, source_name='decode'):
+        self.source = source
+        self.stages = stages
+        self.queue_size = queue_size
+        self.stats = [StageStats(source_name)] + [StageStats(name) for name, _ in stages]
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+        self._stop = threading.Event()
+        self._error = None
+        self._threads = []
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _fail(self, error):
+        if self._error is None:
+            self._error = error
+        self._stop.set()
+
+    def _run_source(self):
+        stats = self.stats[0]
+        stats.start_time = time.time()
+        out_queue = self._queues[0]
+        try:
+            iterator = iter(self.source)
+            while not self._stop.is_set():
+                t = time.time()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                stats.busy_time += time.time() - t
+                stats.items += 1
+                if not self._put(out_queue, item):
+                    break
+        except Exception as e:
+            self._fail(e)
+        finally:
+            stats.end_time = time.time()
+            self._put(out_queue, _END)
+
+    def _run_stage(self, index, function):
+        stats = self.stats[index + 1]
+        stats.start_time = time.time()
+        in_queue, out_queue = self._queues[index], self._queues[index + 1]
+        try:
+            while True:
+                item = self._get(in_queue)
+                if item is _END:
+                    break
+                t = time.time()
+                item = function(item)
+                stats.busy_time += time.time() - t
+                stats.items += 1
+                if not self._put(out_queue, item):
+                    break
+        except Exception as e:
+            self._fail(e)
+        finally:
+            stats.end_time = time.time()
+            self._put(out_queue, _END)
+
+    def __iter__(self):
+        self._threads = [threading.Thread(target=self._run_source, daemon=True)]
+        for index, (_, function) in enumerate(self.stages):
+            self._threads.append(threading.Thread(target=self._run_stage, args=(index, function), daemon=True))
+        for thread in self._threads:
+            thread.start()
+        try:
+            while True:
+                item = self._get(self._queues[-1])
+                if item is _END:
+                    break
+                yield item
+        finally:
+            self._stop.set()
+            for thread in self._threads:
+                thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def report(self):
+        """
+        Per-stage throughput of the pipeline, the stage with the highest utilization is the bottleneck
+        Returns:
+            list of dict with items, busy time, items per second and utilization of each stage
+        """
+        return [stats.as_dict() for stats in self.stats]
@@ -0,0 +1,77 @@
+import time
+
+import cv2
+
+
+def encode_preview(image, max_width=720, quality=70):
+    """
+    Downscale an image and encode it as JPEG for display
+    Parameters:
+        image: BGR image, not modified
+        max_width: width above which the image is downscaled, keeping its aspect ratio
+        quality: JPEG quality, 0 to 100
+    Returns:
+        JPEG bytes
+    """
+    height, width = image.shape[:2]
+    if width > max_width:
+        image = cv2.resize(image, (max_width, max(int(height * max_width / width), 1)), interpolation=cv2.INTER_AREA)
+    success, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    if not success:
+        raise RuntimeError('failed to encode preview image')
+    return buffer.tobytes()
+
+
+class PreviewPublisher:
+    """
+    Display a live stream in a Streamlit placeholder as downscaled JPEGs, at most `max_fps` times per second
+    Frames arriving faster than the display rate are dropped before being resized or encoded, so the cost of the
+    preview does not grow with the processing rate; the full resolution frames are left untouched for the output
+    Parameters:
+        placeholder: Streamlit element to draw into, e.g. st.empty() or st.image([])
+        max_fps: maximum display rate
+        max_width: width above which frames are downscaled
+        quality: JPEG quality, 0 to 100
+    """
+    def __init__(self, placeholder, max_fps=10, max_width=720, quality=70):
+        self.placeholder = placeholder
+        self.max_fps = max_fps
+        self.max_width = max_width
+        self.quality = quality
+        self.published = 0
+        self.dropped = 0
+        self.bytes_sent = 0
+        self._last = 0.0
+
+    def publish(self, image, caption=None, force=False):
+        """
+        Display a frame if the display rate allows it
+        Parameters:
+            image: BGR image
+            caption: caption shown under the image
+            force: display even if the previous frame was displayed less than 1 / max_fps seconds ago
+        Returns:
+            True if the frame was displayed
+        """
+        now = time.time()
+        if not force and self.max_fps and now - self._last < 1 / self.max_fps:
+            self.dropped += 1
+            return False
+        self._last = now
+        jpeg = encode_preview(image, self.max_width, self.quality)
+        # encoded bytes are sent as they are, Streamlit does not decode and re-encode them
+        self.placeholder.image(jpeg, caption=caption)
+        self.published += 1
+        self.bytes_sent += len(jpeg)
+        return True
+
+    def stats(self):
+        """
+        Returns:
+            dict with number of displayed and dropped frames and the mean size of a displayed frame
+        """
+        return {
+            'preview_published': self.published,
+            'preview_dropped': self.dropped,
+            'preview_kb': round(self.bytes_sent / self.published / 1024, 1) if self.published else 0.0,
+        }
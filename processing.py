@@ -0,0 +1,426 @@
+import os
+import time
+import uuid
+import shutil
+from typing import TYPE_CHECKING
+
+import cv2
+import numpy as np
+
+from pipeline import Pipeline
+from batching import BatchPredictor
+from encoders import make_video_writer, job_path
+from mask_codec import encode_mask
+from detection_log import DetectionLogWriter, log_path
+from detection_store import DetectionStoreWriter
+from result_utils import results_with_boxes, offset_result
+if TYPE_CHECKING:
+    from ultralytics.yolo.engine.results import Results
+
+# colors for visualization for image visualization
+COLORS = [(56, 56, 255), (151, 157, 255), (31, 112, 255), (29, 178, 255), (49, 210, 207), (10, 249, 72), (23, 204, 146),
+          (134, 219, 61), (52, 147, 26), (187, 212, 0), (168, 153, 44), (255, 194, 0), (147, 69, 52), (255, 115, 100),
+          (236, 24, 0), (255, 56, 132), (133, 0, 82), (255, 56, 203), (200, 149, 255), (199, 55, 255)]
+
+
+def result_to_columns(result: 'Results'):
+    """
+    Convert result from ultralytics YOLOv8 prediction to columnar (struct of arrays) format
+    Boxes, confidences and classes are moved to host memory in a single transfer
+    Parameters:
+        result: Results from ultralytics YOLOv8 prediction
+    Returns:
+        result_columns: dict of numpy arrays, 'class_id' (n,), 'confidence' (n,) and 'bbox' (n, 4) as x_min, y_min, x_max, y_max
+    """
+    data = result.boxes.boxes.cpu().numpy()
+    return {
+        'class_id': data[:, -1].astype(int),
+        'confidence': data[:, -2],
+        'bbox': data[:, :4].astype(int),
+    }
+
+
+def result_to_json(result: 'Results', tracker=None, mask_format='full'):
+    """
+    Convert result from ultralytics YOLOv8 prediction to json format
+    Parameters:
+        result: Results from ultralytics YOLOv8 prediction
+        tracker: DeepSort tracker
+        mask_format: encoding of object masks, 'full' (nested lists), 'rle' (COCO-style run-length) or 'bitpacked' (bbox cropped bits)
+    Returns:
+        result_list_json: detection result in json format
+    """
+    result_columns = result_to_columns(result)
+    len_results = len(result_columns['class_id'])
+    result_list_json = [
+        {
+            'class_id': class_id,
+            'class': result.names[class_id],
+            'confidence': confidence,
+            'bbox': {
+                'x_min': bbox[0],
+                'y_min': bbox[1],
+                'x_max': bbox[2],
+                'y_max': bbox[3],
+            },
+        } for class_id, confidence, bbox in zip(result_columns['class_id'].tolist(), result_columns['confidence'].tolist(), result_columns['bbox'].tolist())
+    ]
+    if result.masks is not None:
+        masks = result.masks.data.cpu().numpy()
+        for idx in range(len_results):
+            mask = cv2.resize(masks[idx], (result.orig_shape[1], result.orig_shape[0]))
+            result_list_json[idx]['mask'] = encode_mask(mask, mask_format, bbox=result_list_json[idx]['bbox'])
+            result_list_json[idx]['segments'] = result.masks.segments[idx].tolist()
+    if tracker is not None:
+        bbox = result_columns['bbox']
+        ltwh = np.concatenate([bbox[:, :2], bbox[:, 2:] - bbox[:, :2]], axis=1)
+        # DeepSort drops zero-size boxes but not their `others` entries, filter them here so indices stay aligned
+        kept = np.flatnonzero((ltwh[:, 2] > 0) & (ltwh[:, 3] > 0)).tolist()
+        ltwh = ltwh.tolist()
+        bbs = [
+            (
+                ltwh[idx],
+                result_list_json[idx]['confidence'],
+                result_list_json[idx]['class'],
+            ) for idx in kept
+        ]
+        # each detection carries its own index through the tracker, so matched tracks point straight back to it
+        tracks = tracker.update_tracks(bbs, frame=result.orig_img, others=kept)
+        for track in tracks:
+            det_idx = track.get_det_supplementary()
+            if track.time_since_update == 0 and det_idx is not None:
+                result_list_json[det_idx]['object_id'] = int(track.track_id)
+    return result_list_json
+
+
+def view_result_ultralytics(result: 'Results', result_list_json, centers=None):
+    """
+    Visualize result from ultralytics YOLOv8 prediction using ultralytics YOLOv8 built-in visualization function
+    Parameters:
+        result: Results from ultralytics YOLOv8 prediction
+        result_list_json: detection result in json format
+        centers: TrailStore of center points of tracked bounding boxes
+    Returns:
+        result_image_ultralytics: result image from ultralytics YOLOv8 built-in visualization function
+    """
+    result_image_ultralytics = result.plot()
+    for result_json in result_list_json:
+        class_color = COLORS[result_json['class_id'] % len(COLORS)]
+        if 'object_id' in result_json and centers is not None:
+            centers.append(result_json['object_id'], (int((result_json['bbox']['x_min'] + result_json['bbox']['x_max']) / 2), int((result_json['bbox']['y_min'] + result_json['bbox']['y_max']) / 2)))
+            centers.draw(result_image_ultralytics, result_json['object_id'], class_color)
+    return result_image_ultralytics
+
+
+def overlay_masks(image, masks, result_list_json, alpha=0.5):
+    """
+    Blend object masks into image in a single pass, working only inside the bounding boxes of the objects
+    All instances are accumulated into one colour layer covering the union of their bounding boxes,
+    which is then blended once, so cost grows with the masked area rather than with the object count
+    Parameters:
+        image: image to draw on, modified in place
+        masks: (n, h, w) mask tensor from ultralytics YOLOv8 prediction, at inference resolution
+        result_list_json: detection result in json format, in the same order as masks
+        alpha: opacity of the mask colours
+    Returns:
+        image: image with blended masks
+    """
+    height, width = image.shape[:2]
+    rois = []
+    for idx, result in enumerate(result_list_json):
+        x_min, y_min = max(result['bbox']['x_min'], 0), max(result['bbox']['y_min'], 0)
+        x_max, y_max = min(result['bbox']['x_max'], width), min(result['bbox']['y_max'], height)
+        if x_max > x_min and y_max > y_min:
+            rois.append((idx, x_min, y_min, x_max, y_max))
+    if not rois:
+        return image
+    masks = masks.cpu().numpy()
+    scale_x, scale_y = masks.shape[2] / width, masks.shape[1] / height
+    union_x_min, union_y_min = min(roi[1] for roi in rois), min(roi[2] for roi in rois)
+    union_x_max, union_y_max = max(roi[3] for roi in rois), max(roi[4] for roi in rois)
+    color_layer = np.zeros((union_y_max - union_y_min, union_x_max - union_x_min, 3), dtype=np.float32)
+    for idx, x_min, y_min, x_max, y_max in rois:
+        mask_x_min, mask_y_min = int(x_min * scale_x), int(y_min * scale_y)
+        mask_x_max = max(int(np.ceil(x_max * scale_x)), mask_x_min + 1)
+        mask_y_max = max(int(np.ceil(y_max * scale_y)), mask_y_min + 1)
+        mask = cv2.resize(masks[idx, mask_y_min:mask_y_max, mask_x_min:mask_x_max], (x_max - x_min, y_max - y_min))
+        class_color = np.array(COLORS[result_list_json[idx]['class_id'] % len(COLORS)], dtype=np.float32)
+        color_layer[y_min - union_y_min:y_max - union_y_min, x_min - union_x_min:x_max - union_x_min] += mask[..., None] * class_color
+    region = image[union_y_min:union_y_max, union_x_min:union_x_max]
+    cv2.addWeighted(region, 1, color_layer, alpha, 0, dst=region, dtype=cv2.CV_8U)
+    return image
+
+
+def view_result_default(result: 'Results', result_list_json, centers=None):
+    """
+    Visualize result from ultralytics YOLOv8 prediction using default visualization function
+    Parameters:
+        result: Results from ultralytics YOLOv8 prediction
+        result_list_json: detection result in json format
+        centers: TrailStore of center points of tracked bounding boxes
+    Returns:
+        result_image_default: result image from default visualization function
+    """
+    ALPHA = 0.5
+    image = result.orig_img
+    if result.masks is not None:
+        image = overlay_masks(image, result.masks.data, result_list_json, alpha=ALPHA)
+    for result in result_list_json:
+        class_color = COLORS[result['class_id'] % len(COLORS)]
+        text = f"{result['class']} {result['object_id']}: {result['confidence']:.2f}" if 'object_id' in result else f"{result['class']}: {result['confidence']:.2f}"
+        cv2.rectangle(image, (result['bbox']['x_min'], result['bbox']['y_min']), (result['bbox']['x_max'], result['bbox']['y_max']), class_color, 2)
+        (text_width, text_height), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.75, 2)
+        cv2.rectangle(image, (result['bbox']['x_min'], result['bbox']['y_min'] - text_height - baseline), (result['bbox']['x_min'] + text_width, result['bbox']['y_min']), class_color, -1)
+        cv2.putText(image, text, (result['bbox']['x_min'], result['bbox']['y_min'] - baseline), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 255, 255), 2)
+        if 'object_id' in result and centers is not None:
+            centers.append(result['object_id'], (int((result['bbox']['x_min'] + result['bbox']['x_max']) / 2), int((result['bbox']['y_min'] + result['bbox']['y_max']) / 2)))
+            centers.draw(image, result['object_id'], class_color)
+    return image
+
+
+def prune_trails(centers, tracker):
+    """
+    Drop trails of tracks the DeepSort tracker has deleted, call once per frame after the tracker update
+    Parameters:
+        centers: TrailStore of center points of tracked bounding boxes
+        tracker: DeepSort tracker
+    """
+    if centers is None:
+        return
+    if tracker is None:
+        centers.prune()
+    else:
+        centers.prune(int(track.track_id) for track in tracker.tracker.tracks)
+
+
+def image_processing(frame, model, image_viewer=view_result_default, tracker=None, centers=None, mask_format='full', scheduler=None, gate=None,
+                     controller=None):
+    """
+    Process image frame using ultralytics YOLOv8 model and possibly DeepSort tracker if it is provided
+    Parameters:
+        frame: image frame
+        model: ultralytics YOLOv8 model
+        image_viewer: function to visualize result, default is view_result_default, can be view_result_ultralytics
+        tracker: DeepSort tracker
+        centers: TrailStore of center points of tracked bounding boxes
+        mask_format: encoding of object masks in the json result, see result_to_json
+        scheduler: KeyframeScheduler, with a tracker the model only runs on keyframes and the tracker's predicted boxes are used in between
+        gate: MotionGate, static frames skip the model and show the last detections again, in 'roi' mode the model only runs on the moving region
+            and the last detections outside of it are kept
+        controller: ResolutionController, picks the inference image size and frame skip to hold a target fps
+    Returns:
+        result_image: result image with bounding boxes, class names, confidence scores, object masks, and possibly object IDs
+        result_list_json: detection result in json format
+    """
+    start = time.time()
+    predict_kwargs = {}
+    if controller is not None:
+        if controller.skip_frame():
+            result = results_with_boxes(controller.last_result, frame, controller.last_result.boxes.boxes)
+            result_image = image_viewer(result, controller.last_result_list_json, centers=None)
+            controller.update(time.time() - start)
+            return result_image, controller.last_result_list_json
+        predict_kwargs['imgsz'] = controller.imgsz
+    region = None
+    if gate is not None:
+        region = gate.check(frame)
+        if region is None:
+            result = results_with_boxes(gate.last_result, frame, gate.last_result.boxes.boxes)
+            return image_viewer(result, gate.last_result_list_json, centers=None), gate.last_result_list_json
+    if scheduler is not None and tracker is not None and not scheduler.is_keyframe(frame, tracker):
+        result, result_list_json = scheduler.predict(frame, tracker)
+    else:
+        if region is not None and region != (0, 0, frame.shape[1], frame.shape[0]):
+            x_min, y_min, x_max, y_max = region
+            result = offset_result(model.predict(frame[y_min:y_max, x_min:x_max], **predict_kwargs)[0], frame, x_min, y_min)
+            result = gate.merge(result, region)
+        else:
+            result = model.predict(frame, **predict_kwargs)[0]
+        result_list_json = result_to_json(result, tracker=tracker, mask_format=mask_format)
+        if scheduler is not None:
+            scheduler.update(result, result_list_json)
+    if gate is not None:
+        gate.update(result, result_list_json)
+    prune_trails(centers, tracker)
+    result_image = image_viewer(result, result_list_json, centers=centers)
+    if controller is not None:
+        controller.update(time.time() - start, result, result_list_json)
+    return result_image, result_list_json
+
+
+def multi_stream_processing(frames, model, image_viewer=view_result_default, trackers=None, centers=None):
+    """
+    Process one frame from each of several streams with a single batched ultralytics YOLOv8 prediction
+    Each stream keeps its own DeepSort tracker and trails
+    Parameters:
+        frames: list of image frames, one per stream
+        model: ultralytics YOLOv8 model
+        image_viewer: function to visualize result, default is view_result_default, can be view_result_ultralytics
+        trackers: list of DeepSort trackers, one per stream
+        centers: list of TrailStore of center points of tracked bounding boxes, one per stream
+    Returns:
+        list of (result_image, result_list_json), one per stream
+    """
+    results = model.predict(list(frames))
+    outputs = []
+    for idx, result in enumerate(results):
+        tracker = trackers[idx] if trackers is not None else None
+        stream_centers = centers[idx] if centers is not None else None
+        result_list_json = result_to_json(result, tracker=tracker)
+        prune_trails(stream_centers, tracker)
+        outputs.append((image_viewer(result, result_list_json, centers=stream_centers), result_list_json))
+    return outputs
+
+
+def read_video_frames(video_file):
+    """
+    Decode video file frame by frame without holding the whole video in memory
+    Parameters:
+        video_file: video file
+    Returns:
+        generator of decoded BGR frames
+    """
+    cap = cv2.VideoCapture(video_file)
+    try:
+        while True:
+            success, frame = cap.read()
+            if not success:
+                break
+            yield frame
+    finally:
+        cap.release()
+
+
+def video_output_paths(video_file, checkpoint, output_root='output_videos', log_compression=None):
+    """
+    Output files of video_processing for a video and a model, they only exist once the job is complete
+    Parameters:
+        video_file: video file
+        checkpoint: model checkpoint file
+        output_root: folder under which a folder per video holds the outputs
+        log_compression: compression of the detection log, None, 'gzip' or 'zstd'
+    Returns:
+        video_file_name_out: annotated video
+        result_video_json_file: detection log
+        store_dir: columnar detection store
+    """
+    model_name = checkpoint.split('/')[-1].split('.')[0]
+    video_name = os.path.splitext(os.path.basename(video_file))[0]
+    output_folder = os.path.join(output_root, video_name)
+    return (os.path.join(output_folder, f"{video_name}_{model_name}_output.mp4"),
+            log_path(os.path.join(output_folder, f"{video_name}_{model_name}_output"), log_compression),
+            os.path.join(output_folder, f"{video_name}_{model_name}_store"))
+
+
+def video_processing(video_file, model, image_viewer=view_result_default, tracker=None, centers=None, window=8, stage_report=None, batch_size=8, max_wait_ms=20,
+                     encoder='ffmpeg', preset='medium', encoder_threads=0, mask_format='rle', scheduler=None, log_compression=None,
+                     output_root='output_videos', progress=None):
+    """
+    Process video file using ultralytics YOLOv8 model and possibly DeepSort tracker if it is provided
+    Decoding, inference, tracking/annotation and encoding run as pipelined stages on separate threads,
+    connected by bounded queues, so memory use does not grow with video length and frame order is kept.
+    Outputs are written to per-job files and moved into place once complete, so concurrent jobs do not collide
+    Parameters:
+        video_file: video file
+        model: ultralytics YOLOv8 model
+        image_viewer: function to visualize result, default is view_result_default, can be view_result_ultralytics
+        tracker: DeepSort tracker
+        centers: TrailStore of center points of tracked bounding boxes
+        window: maximum number of frames waiting between two consecutive stages
+        stage_report: optional list, filled with per-stage throughput of the pipeline once processing is done
+        batch_size: maximum number of frames predicted in one forward pass
+        max_wait_ms: maximum time the inference stage waits for a batch to fill up
+        encoder: H.264 encoder backend, 'ffmpeg' (frames piped to one ffmpeg process) or 'pyav'
+        preset: x264 encoder preset
+        encoder_threads: number of encoder threads, 0 lets the encoder decide
+        mask_format: encoding of object masks in the json file, see result_to_json
+        scheduler: KeyframeScheduler, with a tracker the model only runs on keyframes (by interval and motion, and on
+            consecutive frames while new tracks are being confirmed) and the tracker's predicted boxes are written in between
+        log_compression: compression of the detection log, None, 'gzip' or 'zstd'
+        output_root: folder under which a folder per video holds the outputs
+        progress: optional progress bar wrapping an iterable, called as progress(iterable, total=..., desc=...), e.g. stqdm or tqdm
+    Returns:
+        video_file_name_out: name of output video file
+        result_video_json_file: detection log, one json line per frame with frame index, timestamp and detections
+        store_dir: columnar detection store of the same detections, open it with detection_store.DetectionStore
+    """
+    cap = cv2.VideoCapture(video_file)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    video_fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    cap.release()
+    video_file_name_out, result_video_json_file, store_dir = video_output_paths(video_file, model.ckpt_path, output_root, log_compression)
+    # earlier outputs stay in place until this job completes, os.replace then swaps them
+    os.makedirs(os.path.dirname(video_file_name_out), exist_ok=True)
+    job_id = uuid.uuid4().hex[:8]
+    job_video_file = job_path(video_file_name_out, job_id)
+    job_json_file = job_path(result_video_json_file, job_id)
+    job_store_dir = job_path(store_dir, job_id)
+    detection_log = DetectionLogWriter(job_json_file, compression=log_compression)
+    store = DetectionStoreWriter(job_store_dir)
+    writer = {}
+    batcher = BatchPredictor(model, batch_size=batch_size, max_wait_ms=max_wait_ms)
+
+    def submit(frame):
+        if scheduler is not None and tracker is not None and not scheduler.is_keyframe(frame):
+            return frame, None
+        return frame, batcher.submit(frame)
+
+    def infer(item):
+        # frames are submitted a window ahead so batches fill up, this stage waits for the model
+        frame, future = item
+        return frame, future.result() if future is not None else None
+
+    def annotate(item):
+        frame, result = item
+        if result is None and scheduler.confirm(tracker):
+            # new objects need the detector on consecutive frames until their tracks are confirmed
+            result = batcher.submit(frame).result()
+        if result is None:
+            result, result_list_json = scheduler.predict(frame, tracker)
+        else:
+            result_list_json = result_to_json(result, tracker=tracker, mask_format=mask_format)
+            if scheduler is not None:
+                scheduler.update(result, result_list_json)
+        prune_trails(centers, tracker)
+        return image_viewer(result, result_list_json, centers=centers), result_list_json
+
+    def encode(item):
+        result_image, result_list_json = item
+        if 'video' not in writer:
+            writer['video'] = make_video_writer(job_video_file, result_image.shape[1], result_image.shape[0], fps=video_fps,
+                                                encoder=encoder, preset=preset, threads=encoder_threads)
+        writer['video'].write(result_image)
+        store.write(detection_log.frames, result_list_json, timestamp=detection_log.frames / video_fps)
+        detection_log.write(detection_log.frames, result_list_json, timestamp=detection_log.frames / video_fps)
+        return len(result_list_json)
+
+    pipeline = Pipeline(read_video_frames(video_file), [('submit', submit), ('infer', infer), ('annotate', annotate), ('encode', encode)], queue_size=window)
+    completed = False
+    try:
+        for _ in (progress(pipeline, total=frame_count, desc=f"Processing video") if progress is not None else pipeline):
+            pass
+        completed = True
+    finally:
+        batcher.close()
+        detection_log.close()
+        store.close()
+        if 'video' in writer:
+            writer['video'].release()
+        if not completed:
+            for job_file in (job_video_file, job_json_file):
+                if os.path.exists(job_file):
+                    os.remove(job_file)
+            shutil.rmtree(job_store_dir, ignore_errors=True)
+    if 'video' in writer:
+        os.replace(job_video_file, video_file_name_out)
+    os.replace(job_json_file, result_video_json_file)
+    if os.path.exists(store_dir):
+        shutil.rmtree(store_dir)
+    os.replace(job_store_dir, store_dir)
+    for stage in pipeline.report():
+        print(f"{stage['stage']}: {stage['items']} frames, {stage['items_per_s']} frames/s, utilization {stage['utilization']:.0%}")
+    batch_stats = batcher.report()
+    print(f"inference batches: mean size {batch_stats['mean_batch_size']}, {batch_stats['model_frames_per_s']} frames/s, p95 latency {batch_stats['latency_p95_ms']} ms")
+    if stage_report is not None:
+        stage_report.extend(pipeline.report())
+    return video_file_name_out, result_video_json_file, store_dir
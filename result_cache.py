@@ -0,0 +1,176 @@
+import os
+import json
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def model_id(checkpoint):
+    """
+    Identifier of a model checkpoint that changes when the weights file is replaced
+    Parameters:
+        checkpoint: model checkpoint file
+    Returns:
+        checkpoint name with the size and modification time of the file when it exists
+    """
+    if os.path.exists(checkpoint):
+        stat = os.stat(checkpoint)
+        return f"{os.path.basename(checkpoint)}:{stat.st_size}:{int(stat.st_mtime)}"
+    return checkpoint
+
+
+def cache_key(image_bytes, model, params=None):
+    """
+    Content address of a detection result
+    Parameters:
+        image_bytes: encoded image file content, as uploaded
+        model: model identifier, see model_id
+        params: dict of inference parameters that change the result
+    Returns:
+        sha256 hex digest
+    """
+    digest = hashlib.sha256(image_bytes)
+    digest.update(b'\0' + model.encode() + b'\0')
+    digest.update(json.dumps(params or {}, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def estimate_size(value):
+    """
+    Approximate size in bytes of a detection result in json format, without serializing it
+    Lists of detections are summed, other lists (masks, segments, run lengths) are sized from their first item,
+    so a full-frame mask costs one step per nesting level instead of one per pixel
+    """
+    if isinstance(value, dict):
+        return sum(len(str(key)) + estimate_size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        if not value:
+            return 2
+        if isinstance(value[0], dict):
+            return sum(estimate_size(item) for item in value)
+        return len(value) * estimate_size(value[0])
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    return 8
+
+
+class ResultCache:
+    """
+    Process-wide cache of annotated images and detection results, keyed by content address
+    Entries are kept in memory up to `memory_budget_mb`, least recently used first out, and optionally persisted
+    to `cache_dir` so they survive restarts. Concurrent requests for the same key compute the result only once
+    Parameters:
+        memory_budget_mb: maximum total size of the cached images and results in memory
+        cache_dir: directory where results are persisted, None to keep them in memory only
+    """
+    def __init__(self, memory_budget_mb=256, cache_dir=None):
+        self.memory_budget_mb = memory_budget_mb
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self._computing = {}
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.npz')
+
+    def _get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        if self.cache_dir is not None and os.path.exists(self._disk_path(key)):
+            with np.load(self._disk_path(key)) as data:
+                entry = data['image'], json.loads(str(data['result']))
+            self._put(key, entry)
+            with self._lock:
+                self.disk_hits += 1
+            return entry
+        return None
+
+    def _put(self, key, entry):
+        image, result_list_json = entry
+        image.flags.writeable = False
+        size = image.nbytes + estimate_size(result_list_json)
+        with self._lock:
+            self._entries[key] = entry
+            self._sizes[key] = size
+            while sum(self._sizes.values()) > self.memory_budget_mb * 2 ** 20 and len(self._entries) > 1:
+                evicted, _ = self._entries.popitem(last=False)
+                del self._sizes[evicted]
+
+    def _persist(self, key, entry):
+        image, result_list_json = entry
+        # write under a unique name and move into place, readers never see a partial file
+        tmp_path = os.path.join(self.cache_dir, f'{key}.{uuid.uuid4().hex[:8]}.partial.npz')
+        np.savez(tmp_path, image=image, result=np.array(json.dumps(result_list_json)))
+        os.replace(tmp_path, self._disk_path(key))
+
+    def get(self, key):
+        """
+        Cached entry of a key
+        Parameters:
+            key: content address, see cache_key
+        Returns:
+            (result_image, result_list_json), None if the key is not cached
+        """
+        return self._get(key)
+
+    def get_or_compute(self, key, compute):
+        """
+        Cached entry of a key, computing and caching it on a miss
+        Parameters:
+            key: content address, see cache_key
+            compute: function without arguments returning (result_image, result_list_json)
+        Returns:
+            (result_image, result_list_json), the image is read-only
+        """
+        entry = self._get(key)
+        if entry is not None:
+            return entry
+        with self._lock:
+            compute_lock = self._computing.setdefault(key, threading.Lock())
+        # only one caller computes a given key, the others wait for its result
+        with compute_lock:
+            entry = self._get(key)
+            if entry is not None:
+                return entry
+            with self._lock:
+                self.misses += 1
+            try:
+                entry = compute()
+                self._put(key, entry)
+                if self.cache_dir is not None:
+                    self._persist(key, entry)
+            finally:
+                with self._lock:
+                    self._computing.pop(key, None)
+            return entry
+
+    def stats(self):
+        """
+        Returns:
+            dict with number of entries, their size in MB, and memory hits, disk hits and misses
+        """
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'size_mb': round(sum(self._sizes.values()) / 2 ** 20, 1),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+            }
+
+
+# shared by every Streamlit session of the process, module state survives script reruns
+result_cache = ResultCache(memory_budget_mb=float(os.environ.get('NIGHTJARS_RESULT_CACHE_MB', 256)),
+                           cache_dir=os.environ.get('NIGHTJARS_RESULT_CACHE_DIR'))
@@ -0,0 +1,39 @@
+import copy
+
+
+def results_with_boxes(template, frame, boxes):
+    """
+    Build ultralytics YOLOv8 Results for a frame from boxes that did not come straight out of the model,
+    e.g. tracker predictions or merged tiles, so result_to_json and the viewers can be used on them
+    Parameters:
+        template: Results from an earlier prediction of the same model, class names and settings are taken from it
+        frame: image frame the boxes belong to
+        boxes: (n, 6) tensor of x_min, y_min, x_max, y_max, confidence, class_id in frame coordinates
+    Returns:
+        result: Results with the given frame and boxes, without masks
+    """
+    from ultralytics.yolo.engine.results import Boxes
+    result = copy.copy(template)
+    result.orig_img = frame
+    result.orig_shape = frame.shape[:2]
+    result.boxes = Boxes(boxes, result.orig_shape)
+    result.masks = None
+    return result
+
+
+def offset_result(result, frame, x_offset, y_offset):
+    """
+    Move Results predicted on a crop of a frame back to the coordinates of the full frame
+    Parameters:
+        result: Results from ultralytics YOLOv8 prediction of the crop
+        frame: full image frame
+        x_offset: left edge of the crop in the frame
+        y_offset: top edge of the crop in the frame
+    Returns:
+        result: Results on the full frame, without masks
+    """
+    import torch
+    data = result.boxes.boxes
+    offset = torch.tensor([x_offset, y_offset, x_offset, y_offset], dtype=data.dtype, device=data.device)
+    boxes = torch.cat([data[:, :4] + offset, data[:, -2:]], dim=1)
+    return results_with_boxes(result, frame, boxes)
@@ -0,0 +1,393 @@
+from collections import Counter
+import math
+
+import cv2
+import numpy as np
+
+from result_utils import results_with_boxes
+
+
+def downscale_gray(frame, width=160):
+    """
+    Downscaled, blurred grey version of a frame, cheap to compare between frames
+    Parameters:
+        frame: BGR image frame
+        width: width of the downscaled frame
+    Returns:
+        small: (h, width) uint8 grey image
+    """
+    height = max(int(frame.shape[0] * width / frame.shape[1]), 1)
+    small = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    return cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+
+
+def motion_score(previous, current):
+    """
+    Mean absolute difference between two downscaled grey frames, between 0 (identical) and 1
+    """
+    return float(cv2.absdiff(previous, current).mean()) / 255
+
+
+def track_uncertainty(tracker):
+    """
+    Largest position uncertainty of the confirmed DeepSort tracks, as Kalman filter standard deviation of the
+    center relative to the box height
+    Parameters:
+        tracker: DeepSort tracker
+    Returns:
+        uncertainty: 0 when there are no confirmed tracks
+    """
+    uncertainty = 0.0
+    for track in tracker.tracker.tracks:
+        if track.is_confirmed():
+            std = np.sqrt(track.covariance[0, 0] + track.covariance[1, 1])
+            uncertainty = max(uncertainty, std / max(track.mean[3], 1.0))
+    return uncertainty
+
+
+def has_tentative_tracks(tracker):
+    """
+    Whether the DeepSort tracker holds tracks that are not confirmed yet
+    """
+    return any(track.is_tentative() for track in tracker.tracker.tracks)
+
+
+class KeyframeScheduler:
+    """
+    Decide on which frames the detector runs, in between the DeepSort tracker's predicted boxes are used
+    A frame is a keyframe every `interval` frames, or earlier when the scene moved more than `motion_threshold`
+    since the last keyframe or the track uncertainty goes over `uncertainty_threshold`. While the tracker holds
+    tentative tracks the detector runs on consecutive frames: DeepSort only matches a tentative track to a detection
+    of the very next frame, so a new object is confirmed after n_init detector runs in a row, and dropped otherwise.
+    `interval` should stay below the tracker's max_age, otherwise tracks are deleted between keyframes.
+    Parameters:
+        interval: maximum number of frames between two detector runs, 1 runs the detector on every frame
+        motion_threshold: motion score since the last keyframe that forces a detector run, None to ignore motion
+        uncertainty_threshold: track uncertainty that forces a detector run, None to ignore it
+        downscale_width: width of the frames used to measure motion
+    """
+    def __init__(self, interval=5, motion_threshold=0.04, uncertainty_threshold=0.5, downscale_width=160):
+        self.interval = interval
+        self.motion_threshold = motion_threshold
+        self.uncertainty_threshold = uncertainty_threshold
+        self.downscale_width = downscale_width
+        self.reasons = Counter()
+        self.confirmations = 0
+        self._since_keyframe = 0
+        self._started = False
+        self._keyframe_small = None
+        self._template = None
+        self._last_detections = {}
+
+    def is_keyframe(self, frame, tracker=None):
+        """
+        Decide whether the detector runs on this frame, call once per frame in frame order
+        Parameters:
+            frame: image frame
+            tracker: DeepSort tracker, its tentative tracks and uncertainty are checked when provided
+        Returns:
+            True if the detector should run on this frame
+        """
+        self._since_keyframe += 1
+        small = downscale_gray(frame, self.downscale_width) if self.motion_threshold is not None else None
+        if not self._started:
+            reason = 'first'
+        elif self._since_keyframe >= self.interval:
+            reason = 'interval'
+        elif tracker is not None and has_tentative_tracks(tracker):
+            reason = 'tentative'
+        elif small is not None and self._keyframe_small is not None and small.shape == self._keyframe_small.shape \
+                and motion_score(self._keyframe_small, small) > self.motion_threshold:
+            reason = 'motion'
+        elif tracker is not None and self.uncertainty_threshold is not None and track_uncertainty(tracker) > self.uncertainty_threshold:
+            reason = 'uncertainty'
+        else:
+            self.reasons['predicted'] += 1
+            return False
+        self.reasons[reason] += 1
+        self._started = True
+        self._since_keyframe = 0
+        self._keyframe_small = small
+        return True
+
+    def confirm(self, tracker):
+        """
+        Check a frame is_keyframe decided to predict against the current tracker state, for callers deciding ahead of
+        the tracker (the video pipeline picks keyframes before the previous frames are tracked)
+        Parameters:
+            tracker: DeepSort tracker, up to date with the previous frame
+        Returns:
+            True if the detector has to run on this frame anyway, because the tracker holds tentative tracks
+        """
+        if not has_tentative_tracks(tracker):
+            return False
+        self.confirmations += 1
+        return True
+
+    def update(self, result, result_list_json):
+        """
+        Remember the detector output of a keyframe, class and confidence of each track are carried to predicted frames
+        Parameters:
+            result: Results from ultralytics YOLOv8 prediction of the keyframe
+            result_list_json: detection result in json format, after tracking
+        """
+        self._template = result
+        for detection in result_list_json:
+            if 'object_id' in detection:
+                self._last_detections[detection['object_id']] = detection
+
+    def predict(self, frame, tracker):
+        """
+        Advance the tracker's Kalman filter one frame and emit its predicted boxes for a non-keyframe
+        Only the motion model is stepped, the tracks are not marked as missed, the next keyframe's update does that
+        Parameters:
+            frame: image frame
+            tracker: DeepSort tracker
+        Returns:
+            result: Results holding the predicted boxes
+            result_list_json: detection result in json format, every detection flagged with 'predicted': True
+        """
+        import torch
+        tracker.tracker.predict()
+        tracks = tracker.tracker.tracks
+        height, width = frame.shape[:2]
+        rows, result_list_json = [], []
+        for track in tracks:
+            track_id = int(track.track_id)
+            if not track.is_confirmed() or track.time_since_update > tracker.tracker.max_age or track_id not in self._last_detections:
+                continue
+            last = self._last_detections[track_id]
+            x_min, y_min, x_max, y_max = track.to_ltrb()
+            x_min, y_min = int(min(max(x_min, 0), width - 1)), int(min(max(y_min, 0), height - 1))
+            x_max, y_max = int(min(max(x_max, x_min + 1), width)), int(min(max(y_max, y_min + 1), height))
+            rows.append([x_min, y_min, x_max, y_max, last['confidence'], last['class_id']])
+            result_list_json.append({
+                'class_id': last['class_id'],
+                'class': last['class'],
+                'confidence': last['confidence'],
+                'bbox': {'x_min': x_min, 'y_min': y_min, 'x_max': x_max, 'y_max': y_max},
+                'object_id': track_id,
+                'predicted': True,
+            })
+        # forget tracks the tracker has deleted
+        live_ids = {int(track.track_id) for track in tracks}
+        self._last_detections = {track_id: detection for track_id, detection in self._last_detections.items() if track_id in live_ids}
+        boxes = torch.tensor(rows, dtype=torch.float32).reshape(-1, 6)
+        return results_with_boxes(self._template, frame, boxes), result_list_json
+
+    def stats(self):
+        """
+        Returns:
+            dict with the number of detector runs per reason and of predicted frames
+        """
+        reasons = self.reasons.copy()
+        if self.confirmations:
+            reasons['predicted'] -= self.confirmations
+            reasons['tentative'] += self.confirmations
+        return dict(reasons)
+
+
+class MotionGate:
+    """
+    Cheap motion check in front of the detector, so static scenes do not go through the model
+    Changes are measured on a downscaled grey frame, either against the last frame the detector ran on ('diff')
+    or against a MOG2 background model ('background'). Without motion the detector is skipped; in 'roi' mode it
+    only runs on the bounding region of the changed pixels, and the last detections outside that region are kept
+    (see merge). The detector still runs on the full frame at least every `max_skipped` frames, so objects that
+    stopped moving are refreshed.
+    Parameters:
+        mode: 'skip' to skip the detector on static frames, 'roi' to also crop moving frames to the changed region
+        method: 'diff' for frame differencing, 'background' for background subtraction
+        pixel_threshold: grey level change for a pixel to count as changed, lower is more sensitive
+        min_changed: fraction of changed pixels for the frame to count as moving, lower is more sensitive
+        downscale_width: width of the frames used to measure motion
+        padding: margin added around the changed region in 'roi' mode, as a fraction of the frame size
+        max_skipped: maximum number of frames skipped, or in 'roi' mode only detected on a region, in a row
+    """
+    def __init__(self, mode='skip', method='diff', pixel_threshold=25, min_changed=0.002, downscale_width=160,
+                 padding=0.05, max_skipped=30):
+        if mode not in ('skip', 'roi'):
+            raise ValueError(f"unknown motion gate mode '{mode}', expected 'skip' or 'roi'")
+        if method not in ('diff', 'background'):
+            raise ValueError(f"unknown motion gate method '{method}', expected 'diff' or 'background'")
+        self.mode = mode
+        self.method = method
+        self.pixel_threshold = pixel_threshold
+        self.min_changed = min_changed
+        self.downscale_width = downscale_width
+        self.padding = padding
+        self.max_skipped = max_skipped
+        self.processed = 0
+        self.skipped = 0
+        self.last_result = None
+        self.last_result_list_json = []
+        self._reference = None
+        self._skipped_in_row = 0
+        self._regions_in_row = 0
+        self._subtractor = cv2.createBackgroundSubtractorMOG2(history=500, varThreshold=pixel_threshold, detectShadows=False) \
+            if method == 'background' else None
+
+    def check(self, frame):
+        """
+        Decide whether and where the detector runs on this frame
+        Parameters:
+            frame: BGR image frame
+        Returns:
+            region: (x_min, y_min, x_max, y_max) in frame coordinates for the detector to run on, None to skip the frame
+        """
+        height, width = frame.shape[:2]
+        small = downscale_gray(frame, self.downscale_width)
+        if self._subtractor is not None:
+            changed = self._subtractor.apply(small) > 0
+        elif self._reference is None or self._reference.shape != small.shape:
+            changed = np.ones(small.shape, dtype=bool)
+        else:
+            changed = cv2.absdiff(self._reference, small) > self.pixel_threshold
+        moving = changed.mean() >= self.min_changed
+        if not moving and self.last_result is not None and self._skipped_in_row < self.max_skipped:
+            self._skipped_in_row += 1
+            self.skipped += 1
+            return None
+        self._skipped_in_row = 0
+        self.processed += 1
+        self._reference = small
+        if self.mode == 'skip' or not moving or self.last_result is None or self._regions_in_row >= self.max_skipped:
+            self._regions_in_row = 0
+            return 0, 0, width, height
+        self._regions_in_row += 1
+        ys, xs = np.nonzero(changed)
+        scale_x, scale_y = width / small.shape[1], height / small.shape[0]
+        pad_x, pad_y = int(self.padding * width), int(self.padding * height)
+        return (max(int(xs.min() * scale_x) - pad_x, 0), max(int(ys.min() * scale_y) - pad_y, 0),
+                min(int((xs.max() + 1) * scale_x) + pad_x, width), min(int((ys.max() + 1) * scale_y) + pad_y, height))
+
+    def merge(self, result, region):
+        """
+        Complete the detections of a region with the last detections outside of it, the model did not see the rest
+        of the frame, so objects there are carried over instead of disappearing from the output and the tracker
+        Parameters:
+            result: Results of the region, in frame coordinates (see result_utils.offset_result)
+            region: (x_min, y_min, x_max, y_max) the detector ran on, as returned by check
+        Returns:
+            result: Results with the detections of the region and the previous detections not overlapping it
+        """
+        import torch
+        boxes = result.boxes.boxes
+        previous = self.last_result.boxes.boxes.to(device=boxes.device, dtype=boxes.dtype)
+        x_min, y_min, x_max, y_max = region
+        outside = (previous[:, 2] <= x_min) | (previous[:, 0] >= x_max) | (previous[:, 3] <= y_min) | (previous[:, 1] >= y_max)
+        return results_with_boxes(result, result.orig_img, torch.cat([boxes, previous[outside]]))
+
+    def update(self, result, result_list_json):
+        """
+        Remember the last detector output, it is shown again on skipped frames
+        """
+        self.last_result = result
+        self.last_result_list_json = result_list_json
+
+    def stats(self):
+        """
+        Returns:
+            dict with the number of processed and skipped frames
+        """
+        return {'processed': self.processed, 'skipped': self.skipped}
+
+
+class ResolutionController:
+    """
+    Hold a target fps on a live stream by trading detection quality for speed
+    The per-frame processing time is smoothed with an exponential moving average. When the stream cannot keep up,
+    the inference image size steps down the `sizes` ladder, and once at the smallest size the detector only runs
+    on every `skip`-th frame, the last detections being shown in between. When the estimated fps of the next
+    better level is above the target by the `hysteresis` margin, quality steps back up. After every change the
+    controller waits `cooldown` frames, so the average settles before the next decision and levels do not oscillate
+    Parameters:
+        target_fps: frames per second to hold
+        sizes: inference image sizes, largest first, rounded up to multiples of `stride`
+        max_skip: maximum frame skip ratio, 1 to only adapt the image size
+        stride: model stride, image sizes must be multiples of it
+        smoothing: weight of the newest processing time in the moving average, between 0 and 1
+        hysteresis: relative fps margin around the target before the level changes
+        cooldown: number of frames after a level change before the next one
+    """
+    def __init__(self, target_fps=15, sizes=(640, 512, 416, 320), max_skip=4, stride=32, smoothing=0.2, hysteresis=0.15,
+                 cooldown=15):
+        # round up to a multiple of the stride the model accepts
+        sizes = sorted({math.ceil(size / stride) * stride for size in sizes}, reverse=True)
+        # quality levels from best to fastest: every image size, then increasing frame skip at the smallest size
+        self.levels = [(size, 1) for size in sizes] + [(sizes[-1], skip) for skip in range(2, max_skip + 1)]
+        self.target_fps = target_fps
+        self.smoothing = smoothing
+        self.hysteresis = hysteresis
+        self.cooldown = cooldown
+        self.level = 0
+        self.changes = 0
+        self.last_result = None
+        self.last_result_list_json = []
+        self._frame_time = None
+        self._since_change = 0
+        self._frame = 0
+
+    @property
+    def imgsz(self):
+        return self.levels[self.level][0]
+
+    @property
+    def skip(self):
+        return self.levels[self.level][1]
+
+    @property
+    def fps(self):
+        return 1 / self._frame_time if self._frame_time else 0.0
+
+    def skip_frame(self):
+        """
+        Decide whether the detector skips this frame, call once per frame before processing it
+        Returns:
+            True when the last detections should be shown again instead of running the detector
+        """
+        self._frame += 1
+        return self.last_result is not None and self._frame % self.skip != 0
+
+    def _estimated_frame_time(self, level):
+        # processing time scales with the image area, and skipped frames cost next to nothing
+        size, skip = self.levels[level]
+        current_size, current_skip = self.levels[self.level]
+        return self._frame_time * (size / current_size) ** 2 * current_skip / skip
+
+    def update(self, processing_time, result=None, result_list_json=None):
+        """
+        Record the processing time of a frame and change the quality level if needed
+        Parameters:
+            processing_time: time spent processing the frame in seconds
+            result: Results of the detector when it ran on this frame, shown again on skipped frames
+            result_list_json: detection result in json format of the same frame
+        """
+        if result is not None:
+            self.last_result = result
+            self.last_result_list_json = result_list_json
+        if self._frame_time is None:
+            self._frame_time = processing_time
+        else:
+            self._frame_time = (1 - self.smoothing) * self._frame_time + self.smoothing * processing_time
+        self._since_change += 1
+        if self._since_change < self.cooldown:
+            return
+        if self.fps < self.target_fps * (1 - self.hysteresis) and self.level < len(self.levels) - 1:
+            self._change_level(self.level + 1)
+        elif self.level > 0 and self._estimated_frame_time(self.level - 1) * self.target_fps * (1 + self.hysteresis) < 1:
+            self._change_level(self.level - 1)
+
+    def _change_level(self, level):
+        # start the new level from its estimated processing time, the moving average corrects it
+        self._frame_time = self._estimated_frame_time(level)
+        self.level = level
+        self.changes += 1
+        self._since_change = 0
+
+    def stats(self):
+        """
+        Returns:
+            dict with the current image size, frame skip, estimated fps and number of level changes
+        """
+        return {'imgsz': self.imgsz, 'skip': self.skip, 'fps': round(self.fps, 2), 'level_changes': self.changes}
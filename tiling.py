@@ -0,0 +1,109 @@
+import math
+
+import numpy as np
+
+from result_utils import results_with_boxes
+
+
+def tile_grid(width, height, tile_size=640, overlap=0.2, max_tiles=16):
+    """
+    Overlapping tiles covering a frame, the last tile of each row and column is aligned with the frame edge
+    When more than `max_tiles` tiles would be needed, the tiles are enlarged until they fit the cap
+    Parameters:
+        width: frame width
+        height: frame height
+        tile_size: side of the square tiles in pixels
+        overlap: overlap between neighbouring tiles, as a fraction of the tile size
+        max_tiles: maximum number of tiles per frame
+    Returns:
+        list of (x_min, y_min, x_max, y_max) tiles
+    """
+    while True:
+        tile_w, tile_h = min(tile_size, width), min(tile_size, height)
+        step_x, step_y = max(int(tile_w * (1 - overlap)), 1), max(int(tile_h * (1 - overlap)), 1)
+        n_x = math.ceil((width - tile_w) / step_x) + 1
+        n_y = math.ceil((height - tile_h) / step_y) + 1
+        if n_x * n_y <= max_tiles or (tile_w == width and tile_h == height):
+            break
+        tile_size = int(tile_size * 1.25) + 1
+    xs = np.linspace(0, width - tile_w, n_x).round().astype(int)
+    ys = np.linspace(0, height - tile_h, n_y).round().astype(int)
+    return [(int(x), int(y), int(x) + tile_w, int(y) + tile_h) for y in ys for x in xs]
+
+
+def merge_detections(boxes, iou_thres=0.45, agnostic=False, max_det=300):
+    """
+    Merge detections of overlapping tiles with class-aware NMS, highest confidence first
+    Parameters:
+        boxes: (n, 6) tensor of x_min, y_min, x_max, y_max, confidence, class_id in frame coordinates
+        iou_thres: IoU above which two boxes of the same class are considered the same object
+        agnostic: suppress overlapping boxes across classes too
+        max_det: maximum number of kept detections
+    Returns:
+        (m, 6) tensor of the kept detections
+    """
+    # torchvision only, utils.general pulls in pandas, matplotlib and resets the OpenCV thread count on import
+    from torchvision.ops import batched_nms
+    if not len(boxes):
+        return boxes
+    classes = boxes[:, 5] * 0 if agnostic else boxes[:, 5]
+    keep = batched_nms(boxes[:, :4].float(), boxes[:, 4].float(), classes.long(), iou_thres)[:max_det]
+    return boxes[keep]
+
+
+class TiledPredictor:
+    """
+    Split high resolution frames into overlapping tiles, run all tiles through the model in one forward pass and
+    merge the detections, so small distant objects keep enough pixels after the model's resize
+    It can be used in place of the model in image_processing and video_processing, tiled results have no masks.
+    Parameters:
+        model: ultralytics YOLOv8 model
+        tile_size: side of the square tiles in pixels
+        overlap: overlap between neighbouring tiles, as a fraction of the tile size
+        max_tiles: maximum number of tiles per frame
+        iou_thres: IoU of the NMS merging the tiles
+        include_full_frame: also predict on the whole frame, to keep objects larger than a tile
+    """
+    def __init__(self, model, tile_size=640, overlap=0.2, max_tiles=16, iou_thres=0.45, include_full_frame=True):
+        self.model = model
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.max_tiles = max_tiles
+        self.iou_thres = iou_thres
+        self.include_full_frame = include_full_frame
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__['model'], name)
+
+    def predict(self, source, **predict_kwargs):
+        """
+        Tiled prediction of a single frame or a list of frames, the tiles of all frames share one forward pass
+        Parameters:
+            source: image frame or list of image frames
+        Returns:
+            list of Results from ultralytics YOLOv8 prediction, one per frame
+        """
+        import torch
+        frames = source if isinstance(source, (list, tuple)) else [source]
+        inputs, owners = [], []
+        for idx, frame in enumerate(frames):
+            height, width = frame.shape[:2]
+            regions = tile_grid(width, height, self.tile_size, self.overlap, self.max_tiles)
+            if self.include_full_frame and regions != [(0, 0, width, height)]:
+                regions = [(0, 0, width, height)] + regions
+            for x_min, y_min, x_max, y_max in regions:
+                inputs.append(frame[y_min:y_max, x_min:x_max])
+                owners.append((idx, x_min, y_min))
+        tile_results = self.model.predict(inputs, **predict_kwargs)
+        tile_boxes = [[] for _ in frames]
+        templates = [None] * len(frames)
+        for (idx, x_min, y_min), result in zip(owners, tile_results):
+            data = result.boxes.boxes
+            offset = torch.tensor([x_min, y_min, x_min, y_min], dtype=data.dtype, device=data.device)
+            tile_boxes[idx].append(torch.cat([data[:, :4] + offset, data[:, -2:]], dim=1))
+            templates[idx] = templates[idx] or result
+        results = []
+        for frame, boxes, template in zip(frames, tile_boxes, templates):
+            merged = merge_detections(torch.cat(boxes), iou_thres=self.iou_thres)
+            results.append(results_with_boxes(template, frame, merged))
+        return results
@@ -0,0 +1,100 @@
+from collections import OrderedDict, deque
+
+import cv2
+import numpy as np
+
+
+def trail_thickness(j):
+    # thickness of the trail segment ending at the j-th center point, oldest segment is the thickest
+    return int(np.sqrt(64 / float(j + 1)) * 2)
+
+
+class TrailStore:
+    """
+    Trails of center points of tracked objects, keyed by track ID
+    Trails of tracks deleted by the tracker or idle for more than `max_idle` frames are dropped, and at most
+    `max_tracks` trails are kept, evicting the least recently updated one, so memory stays bounded
+    Parameters:
+        maxlen: number of center points kept per trail
+        max_tracks: maximum number of trails kept at once
+        max_idle: number of frames a trail is kept without being updated
+    """
+    def __init__(self, maxlen=30, max_tracks=1000, max_idle=30):
+        self.maxlen = maxlen
+        self.max_tracks = max_tracks
+        self.max_idle = max_idle
+        self._trails = OrderedDict()
+        self._last_seen = {}
+        self._frame = 0
+        # consecutive segments sharing a thickness are drawn with one polyline, as (first, last) point index and thickness
+        self._segment_groups = []
+        for j in range(1, maxlen):
+            thickness = trail_thickness(j)
+            if self._segment_groups and self._segment_groups[-1][2] == thickness:
+                self._segment_groups[-1][1] = j
+            else:
+                self._segment_groups.append([j - 1, j, thickness])
+
+    def __len__(self):
+        return len(self._trails)
+
+    def __contains__(self, track_id):
+        return track_id in self._trails
+
+    def __getitem__(self, track_id):
+        return self._trails[track_id]
+
+    def append(self, track_id, point):
+        """
+        Add center point to the trail of a track, creating the trail if needed
+        Parameters:
+            track_id: track ID
+            point: (x, y) center point
+        """
+        trail = self._trails.get(track_id)
+        if trail is None:
+            trail = self._trails[track_id] = deque(maxlen=self.maxlen)
+            while len(self._trails) > self.max_tracks:
+                evicted, _ = self._trails.popitem(last=False)
+                self._last_seen.pop(evicted, None)
+        else:
+            self._trails.move_to_end(track_id)
+        trail.append(point)
+        self._last_seen[track_id] = self._frame
+
+    def prune(self, active_ids=None):
+        """
+        Advance one frame and drop trails of deleted or idle tracks, call once per frame after the tracker update
+        Parameters:
+            active_ids: IDs of the tracks still alive in the tracker, None to only drop idle trails
+        """
+        self._frame += 1
+        active_ids = set(active_ids) if active_ids is not None else None
+        for track_id in list(self._trails):
+            if (active_ids is not None and track_id not in active_ids) or self._frame - self._last_seen[track_id] > self.max_idle:
+                del self._trails[track_id]
+                del self._last_seen[track_id]
+
+    def clear(self):
+        self._trails.clear()
+        self._last_seen.clear()
+
+    def draw(self, image, track_id, color):
+        """
+        Draw the trail of a track, with one cv2.polylines call per segment thickness
+        Parameters:
+            image: image to draw on
+            track_id: track ID
+            color: BGR color of the trail
+        Returns:
+            image: image with the trail
+        """
+        trail = self._trails.get(track_id)
+        if trail is None or len(trail) < 2:
+            return image
+        points = np.array(trail, dtype=np.int32)
+        for first, last, thickness in self._segment_groups:
+            if first >= len(points) - 1:
+                break
+            cv2.polylines(image, [points[first:last + 1]], False, color, thickness)
+        return image